@@ -4,4 +4,5 @@ pip install -r requirements.txt
 pip install spacy
 python -m spacy download it_core_news_lg
 cd "script\inclusivity_management\"
+python lexicon_store.py
 PAUSE
\ No newline at end of file
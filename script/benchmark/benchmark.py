@@ -0,0 +1,558 @@
+import argparse
+import csv
+import gc
+import itertools
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append('../inclusivity_management')
+sys.path.append('../search_tweets')
+
+import Rules
+import token_array
+import utils
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows: the peak RSS is not measured
+    resource = None
+
+"""
+benchmark.py:
+This module measures the performance of the pipeline of Rules.py on the corpora shipped with the repo
+(tweets.csv, input.csv and data.json) and on synthetic scale-ups of them, obtained repeating the corpus
+up to the requested number of tweets.
+Every stage is timed separately:
+- startup:help:   a new process running `Rules.py --help`, --startup_runs times (the tweets are the runs).
+- startup:import: a new process importing Rules, --startup_runs times.
+- clean:        utils.clean_tweet() on each tweet.
+- clean_batch:  utils.clean_batch() on all the tweets.
+- parse:        Rules.save_postag(), only up to --parse_limit tweets since it's the slowest stage.
+- rule:<name>:  each rule of Rules.RULES on each parsed tweet.
+- rules:        Rules.rules() end to end, scoring all the parsed tweets and writing them with pandas.
+- output:       Rules.write_results(), the streaming csv writer.
+For each stage it reports tweets/s, the p50 and p99 latency per tweet and the peak RSS during the stage: on
+Linux the peak of the process is reset before each stage (/proc/self/clear_refs), elsewhere only the peak of
+the whole process is known, so it's marked with '*' in the table ('rss_scope': 'process' in the report).
+Every stage but parse and startup runs --repeats times and the fastest run is reported, the least disturbed
+by the rest of the machine.
+The report can be saved as a baseline (--save_baseline) and compared with it (--baseline): the run fails
+if the throughput of a stage drops, or its peak RSS grows, more than --threshold; the peaks of the whole
+process are not compared. Only the scale-ups (--sizes) are compared, not the corpora at their own size, and
+only the stages that take at least --min_seconds, since the shorter ones are dominated by noise. The startup
+stages are compared on their fastest run, and fail if it is slower than the baseline by more than
+--startup_tolerance seconds.
+Before timing, the output of utils.clean_tweet() is checked to be identical to the one of the sequential
+substitutions it replaces (reference_clean_tweet()) on the corpora; the run fails if it is not.
+The run also fails if `Rules.py --help` takes more than --startup_target seconds (p50), or if importing Rules
+imports one of LAZY_MODULES, that only the code paths that use them should import.
+With --tiers the benchmark compares instead the models of the given tiers (see Rules.MODEL_TIERS) on the first
+--parse_limit tweets of the corpora, each loaded in a new process: for each one it reports the number of word
+vectors, the load time, the tweets/s of the parsing, the peak RSS and the agreement of the scores with the
+last tier, as the fraction of tweets with the same score and with the same label, and the mean
+absolute difference of the scores.
+The model is loaded only for the parse stage; without it the parses of data.json are used, so the
+benchmark of the rules can run without the model.
+Run it from script/benchmark, as Rules.py from script/inclusivity_management.
+"""
+
+CORPORA = ['../../tweets.csv', '../../input.csv', '../../data.json']
+SIZES = [10000, 100000, 1000000]
+PARSE_LIMIT = 10000
+THRESHOLD = 0.20
+BASELINE_PATH = 'baseline.json'
+REPORT_PATH = 'benchmark_report.json'
+# runs of each stage, the fastest one is reported
+REPEATS = 3
+# stages shorter than this (seconds) are not compared with the baseline
+MIN_SECONDS = 0.05
+# seconds of `Rules.py --help` (p50) above which the run fails
+STARTUP_TARGET = 1.0
+STARTUP_RUNS = 5
+# seconds the fastest startup can be slower than the baseline
+STARTUP_TOLERANCE = 0.1
+STARTUP_COMMANDS = [
+    ('startup:help', ['Rules.py', '--help']),
+    ('startup:import', ['-c', 'import Rules']),
+]
+# modules that importing Rules should not import
+LAZY_MODULES = ['spacy', 'pandas', 'numpy', 'yaml', 'search_tweets', 'requests', 'tqdm', 'vector_engine']
+RULES_DIRECTORY = '../inclusivity_management'
+TIERS_REPORT_PATH = 'tier_report.json'
+
+
+def read_corpus(path):
+    """
+    Returns the texts of the tweets of a corpus, and their parses if the corpus has them (data.json).
+    """
+    if path.endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        texts = [tweet['raw_text'] for tweet in data]
+        parses = [data_json_tokens(tweet['spacy']['processed_text']) for tweet in data if 'spacy' in tweet]
+        return texts, parses if len(parses) == len(texts) else None
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        return [row['Tweet'] for row in csv.DictReader(f)], None
+
+
+def data_json_tokens(processed_text):
+    # 'text | POS : NOUN | DEP : obj | MORPH : Gender=Fem-Number=Sing' -> the tokens of parse_cache.doc_tokens(),
+    # data.json has no lemmas so the text is used
+    tokens = []
+    for token in processed_text:
+        text, pos, dep, morph = token.rsplit(' | ', 3)
+        morph = morph.split(' : ', 1)[1].strip().replace('-', '|')
+        tokens.append([text, pos.split(' : ', 1)[1], dep.split(' : ', 1)[1], morph, text])
+    return tokens
+
+
+def reference_clean_tweet(t):
+    # the cleaning as four re.sub() in a row, the reference of the single pass of utils.clean_tweet()
+    t = re.sub("@[A-Za-z0-9_]+", "", t)
+    t = re.sub("#[A-Za-z0-9_]+", "", t)
+    t = re.sub(r"http\S+", "", t)
+    return re.sub(utils.EMOJI, "", t, flags=re.UNICODE).lower()
+
+
+def verify_clean(texts):
+    """
+    Returns the texts that utils.clean_tweet() and utils.clean_batch() don't clean as reference_clean_tweet().
+    """
+    return [t for t, cleaned in zip(texts, utils.clean_batch(texts))
+            if cleaned != reference_clean_tweet(t) or utils.clean_tweet(t) != cleaned]
+
+
+def scale(items, size):
+    # the corpus repeated up to size items: the items are shared, not copied
+    return list(itertools.islice(itertools.cycle(items), size))
+
+
+def reset_peak_rss():
+    """
+    Resets the peak RSS of the process, so peak_rss_mb() is the peak since the reset.
+    Returns False if it can't be reset (before Linux 4.0, other systems).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class StageTimer:
+
+    def __init__(self, stage, size):
+        self.stage = stage
+        self.size = size
+        self.latencies = []
+        self.total = 0.0
+        # the timer is created right before the stage runs
+        self.stage_rss = reset_peak_rss()
+
+    def run(self, function, items):
+        """
+        Calls function on each item, timing each call.
+        """
+        latencies = self.latencies
+        clock = time.perf_counter
+        start = clock()
+        for item in items:
+            before = clock()
+            function(item)
+            latencies.append(clock() - before)
+        self.total += clock() - start
+
+    def run_stream(self, results):
+        """
+        Consumes a generator of results, timing the wait for each one.
+        """
+        latencies = self.latencies
+        clock = time.perf_counter
+        start = before = clock()
+        for _ in results:
+            now = clock()
+            latencies.append(now - before)
+            before = now
+        self.total += clock() - start
+
+    def run_once(self, function, n_tweets):
+        """
+        Calls function once on n_tweets tweets: the latency is the mean one.
+        """
+        start = time.perf_counter()
+        function()
+        self.total += time.perf_counter() - start
+        self.latencies.extend([self.total / n_tweets] * n_tweets if n_tweets else [])
+
+    def result(self):
+        n_tweets = len(self.latencies)
+        return {
+            'stage': self.stage,
+            'size': self.size,
+            'tweets': n_tweets,
+            'seconds': self.total,
+            'tweets_per_s': n_tweets / self.total if self.total > 0 else 0.0,
+            'p50_ms': percentile(self.latencies, 0.50) * 1000,
+            'p99_ms': percentile(self.latencies, 0.99) * 1000,
+            'peak_rss_mb': peak_rss_mb(),
+            'rss_scope': 'stage' if self.stage_rss else 'process',
+        }
+
+
+def run_python(arguments):
+    return subprocess.run([sys.executable] + arguments, cwd=RULES_DIRECTORY, stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL, check=True, universal_newlines=True).stdout
+
+
+def bench_startup(runs):
+    stages = []
+    for stage, arguments in STARTUP_COMMANDS:
+        # the first run compiles the bytecode and fills the file cache
+        run_python(arguments)
+        timer = StageTimer(stage, runs)
+        timer.run(lambda _: run_python(arguments), range(runs))
+        # the memory is the one of the new processes, not measured
+        stages.append(dict(timer.result(), peak_rss_mb=None, best_ms=min(timer.latencies) * 1000))
+    return stages
+
+
+def eager_imports():
+    # the LAZY_MODULES imported by importing Rules
+    code = "import sys, Rules; print(' '.join(m for m in {!r} if m in sys.modules))".format(LAZY_MODULES)
+    return run_python(['-c', code]).split()
+
+
+def score_tier(model_name, parse_limit, batch_size, path):
+    """
+    Parses and scores the first parse_limit tweets of the corpora with a model, saving the scores and the costs
+    of the model as JSON to path. It's run in a new process for each model, see tier_report().
+    """
+    texts = []
+    for corpus in CORPORA:
+        texts.extend(read_corpus(corpus)[0])
+    texts = texts[:parse_limit]
+    start = time.perf_counter()
+    Rules.nlp = Rules.load_model(model_name)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    sentences, phrases = Rules.save_postag({'Tweet': texts}, batch_size)
+    parse_seconds = time.perf_counter() - start
+    scores = [result['inclusive_rate'] for result in Rules.iter_rules(zip(sentences, phrases), False)]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'model': model_name,
+            'vectors': Rules.nlp.vocab.vectors.shape[0],
+            'load_seconds': load_seconds,
+            'tweets_per_s': len(texts) / parse_seconds if parse_seconds > 0 else 0.0,
+            'peak_rss_mb': peak_rss_mb(),
+            'scores': scores,
+        }, f)
+
+
+def label(score):
+    return 'inclusive' if score > 0 else 'neutral' if score == 0 else 'non-inclusive'
+
+
+def tier_report(tiers, parse_limit, batch_size, log=print):
+    """
+    Returns the costs of the models of tiers and the agreement of their scores with the ones of the last tier.
+    The tiers not installed are skipped.
+    """
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for tier in tiers:
+            path = os.path.join(directory, 'tier.json')
+            code = "import benchmark; benchmark.score_tier({!r}, {!r}, {!r}, {!r})".format(
+                tier, parse_limit, batch_size, path)
+            try:
+                subprocess.run([sys.executable, '-c', code], stdout=subprocess.DEVNULL, check=True)
+            except subprocess.CalledProcessError:
+                log("Model {} not available: skipped".format(tier))
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                run = json.load(f)
+            run['tier'] = tier
+            runs.append(run)
+    if not runs:
+        return []
+    reference = runs[-1]['scores']
+    report = []
+    for run in runs:
+        scores = run.pop('scores')
+        pairs = list(zip(scores, reference))
+        report.append(dict(run, tweets=len(scores),
+                           score_agreement=sum(a == b for a, b in pairs) / len(pairs) if pairs else 1.0,
+                           label_agreement=sum(label(a) == label(b) for a, b in pairs) / len(pairs) if pairs else 1.0,
+                           mean_abs_diff=sum(abs(a - b) for a, b in pairs) / len(pairs) if pairs else 0.0))
+    return report
+
+
+def tier_table(report):
+    lines = ["{:<20} {:>7} {:>8} {:>10} {:>8} {:>8} {:>8} {:>9}".format(
+        'model', 'vectors', 'load s', 'tweets/s', 'RSS MB', 'score %', 'label %', 'mean |d|')]
+    for run in report:
+        rss = '{:.0f}'.format(run['peak_rss_mb']) if run['peak_rss_mb'] is not None else '-'
+        lines.append("{:<20} {:>7} {:>8.2f} {:>10.1f} {:>8} {:>8.1f} {:>8.1f} {:>9.4f}".format(
+            run['tier'], run['vectors'], run['load_seconds'], run['tweets_per_s'], rss,
+            run['score_agreement'] * 100, run['label_agreement'] * 100, run['mean_abs_diff']))
+    return '\n'.join(lines)
+
+
+def best_of(repeats, bench):
+    """
+    Calls bench() repeats times, and returns for each of the stages it returns the result of its fastest run.
+    """
+    best = bench()
+    for _ in range(repeats - 1):
+        best = [min(previous, stage, key=lambda result: result['seconds']) for previous, stage in zip(best, bench())]
+    return best
+
+
+def bench_clean(texts, size):
+    timer = StageTimer('clean', size)
+    timer.run(utils.clean_tweet, texts)
+    return timer.result()
+
+
+def bench_clean_batch(texts, size):
+    timer = StageTimer('clean_batch', size)
+    timer.run_once(lambda: utils.clean_batch(texts), len(texts))
+    return timer.result()
+
+
+def bench_parse(texts, size, batch_size):
+    timer = StageTimer('parse', size)
+    timer.run_once(lambda: Rules.save_postag({'Tweet': texts}, batch_size), len(texts))
+    return timer.result()
+
+
+def bench_rules(parsed, size):
+    results = []
+    for rule in Rules.rule_set().rules:
+        timer = StageTimer('rule:' + rule.name, size)
+        timer.run(lambda item: rule.evaluate(item[0], item[1], True), parsed)
+        results.append(timer.result())
+    return results
+
+
+def bench_rules_end_to_end(parsed, size, directory):
+    output = os.path.join(directory, 'results.csv')
+    sentences = [sentence for sentence, phrase in parsed]
+    phrases = [phrase for sentence, phrase in parsed]
+    # untimed, rules() imports pandas on the first call
+    Rules.rules(sentences[:1], phrases[:1], True, output=output)
+    timer = StageTimer('rules', size)
+    timer.run_once(lambda: Rules.rules(sentences, phrases, True, output=output), len(parsed))
+    return timer.result()
+
+
+def bench_output(scored, size, directory):
+    timer = StageTimer('output', size)
+    timer.run_once(lambda: Rules.write_results(scored, os.path.join(directory, 'output.csv')), len(scored))
+    return timer.result()
+
+
+def run(sizes, parse_limit, model_name, batch_size, startup_runs=STARTUP_RUNS, repeats=REPEATS, log=print):
+    eager = eager_imports()
+    if eager:
+        raise ValueError("importing Rules imports {}".format(', '.join(eager)))
+    report = bench_startup(startup_runs)
+    for stage in report:
+        log(format_row(stage))
+
+    texts = []
+    parses = []
+    for path in CORPORA:
+        corpus_texts, corpus_parses = read_corpus(path)
+        texts.extend(corpus_texts)
+        if corpus_parses is not None:
+            parses.extend(zip(utils.clean_batch(corpus_texts), corpus_parses))
+
+    mismatches = verify_clean(texts)
+    if mismatches:
+        raise ValueError("utils.clean_tweet() differs from the sequential substitutions on {} tweets, e.g. {!r}".format(
+            len(mismatches), mismatches[0]))
+
+    try:
+        Rules.nlp = Rules.load_model(model_name)
+    except OSError as e:
+        log("Model {} not available ({}): the parse stage is skipped and the rules use the parses of "
+            "data.json".format(model_name, e))
+        Rules.nlp = None
+
+    if Rules.nlp is not None:
+        sentences, phrases = Rules.save_postag({'Tweet': texts}, batch_size)
+        parsed = list(zip(sentences, phrases))
+    else:
+        parsed = [(sentence, token_array.TokenArray.from_tokens(tokens)) for sentence, tokens in parses]
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in [len(texts)] + sizes:
+            log("Size {}".format(size))
+            scaled_texts = scale(texts, size)
+            scaled_parsed = scale(parsed, size)
+            stages = best_of(repeats, lambda: [bench_clean(scaled_texts, size), bench_clean_batch(scaled_texts, size)])
+            if Rules.nlp is not None and size <= parse_limit:
+                stages.append(bench_parse(scaled_texts, size, batch_size))
+            stages.extend(best_of(repeats, lambda: bench_rules(scaled_parsed, size)))
+            stages.extend(best_of(repeats, lambda: [bench_rules_end_to_end(scaled_parsed, size, directory)]))
+            scored = list(Rules.iter_rules(scaled_parsed, True))
+            stages.extend(best_of(repeats, lambda: [bench_output(scored, size, directory)]))
+            for stage in stages:
+                # the corpora at their own size are too small to be compared with the baseline
+                stage['gated'] = size in sizes
+                log(format_row(stage))
+            report.extend(stages)
+            del scaled_texts, scaled_parsed, scored
+            gc.collect()
+    return report
+
+
+def format_row(stage):
+    rss = '{:.0f}'.format(stage['peak_rss_mb']) if stage['peak_rss_mb'] is not None else '-'
+    if stage.get('rss_scope') == 'process' and stage['peak_rss_mb'] is not None:
+        rss += '*'
+    return "{:<32} {:>9} {:>12.1f} {:>10.3f} {:>10.3f} {:>8}".format(
+        stage['stage'], stage['size'], stage['tweets_per_s'], stage['p50_ms'], stage['p99_ms'], rss)
+
+
+def table(report):
+    header = "{:<32} {:>9} {:>12} {:>10} {:>10} {:>8}".format('stage', 'tweets', 'tweets/s', 'p50 ms', 'p99 ms',
+                                                               'RSS MB')
+    return '\n'.join([header] + [format_row(stage) for stage in report])
+
+
+def compare(report, baseline, threshold=THRESHOLD, min_seconds=MIN_SECONDS, startup_tolerance=STARTUP_TOLERANCE):
+    """
+    Returns the regressions of report with respect to baseline: the stages of the scale-ups, taking at least
+    min_seconds, whose throughput dropped, or whose peak RSS during the stage grew, more than threshold, and
+    the startup stages whose fastest run is slower by more than startup_tolerance seconds.
+    """
+    reference = {(stage['stage'], stage['size']): stage for stage in baseline}
+    regressions = []
+    for stage in report:
+        base = reference.get((stage['stage'], stage['size']))
+        if base is None:
+            continue
+        if stage['stage'].startswith('startup:'):
+            best_ms = stage.get('best_ms', stage['p50_ms'])
+            base_ms = base.get('best_ms', base['p50_ms'])
+            if best_ms > base_ms + startup_tolerance * 1000:
+                regressions.append("{}: {:.0f} ms, baseline {:.0f} ms".format(stage['stage'], best_ms, base_ms))
+            continue
+        if not stage.get('gated', True):
+            continue
+        if min(stage['seconds'], base['seconds']) >= min_seconds and \
+                stage['tweets_per_s'] < base['tweets_per_s'] * (1 - threshold):
+            regressions.append("{} ({} tweets): {:.1f} tweets/s, baseline {:.1f}".format(
+                stage['stage'], stage['size'], stage['tweets_per_s'], base['tweets_per_s']))
+        if stage['peak_rss_mb'] is not None and base.get('peak_rss_mb') is not None and \
+                stage.get('rss_scope') == 'stage' and base.get('rss_scope') == 'stage' and \
+                stage['peak_rss_mb'] > base['peak_rss_mb'] * (1 + threshold):
+            regressions.append("{} ({} tweets): peak RSS {:.0f} MB, baseline {:.0f} MB".format(
+                stage['stage'], stage['size'], stage['peak_rss_mb'], base['peak_rss_mb']))
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Benchmark of the inclusivity rate calculator')
+    parser.add_argument('--sizes', type=str, default=','.join(str(size) for size in SIZES),
+                        help="This parameter should be the comma separated numbers of tweets of the scale-ups")
+    parser.add_argument('--parse_limit', type=int, default=PARSE_LIMIT,
+                        help="This parameter should be the largest number of tweets parsed by the parse stage")
+    parser.add_argument('--model', type=str, default=Rules.MODEL_NAME,
+                        help="This parameter should be the spaCy model used by the parse stage: a tier (sm, md, lg), "
+                             "the name of a package or the path of a model")
+    parser.add_argument('--batch_size', type=int, default=Rules.BATCH_SIZE,
+                        help="This parameter should be the number of tweets parsed together by spaCy")
+    parser.add_argument('--report', type=str, default=REPORT_PATH,
+                        help="This parameter should be the path of the JSON report")
+    parser.add_argument('--baseline', type=str, default=BASELINE_PATH,
+                        help="This parameter should be the path of the JSON baseline")
+    parser.add_argument('--save_baseline', dest='save_baseline', action='store_true',
+                        help="This parameter saves the report as the new baseline")
+    parser.set_defaults(save_baseline=False)
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help="This parameter should be the fraction of regression that makes the run fail")
+    parser.add_argument('--repeats', type=int, default=REPEATS,
+                        help="This parameter should be the number of runs of each stage, the fastest is reported")
+    parser.add_argument('--min_seconds', type=float, default=MIN_SECONDS,
+                        help="This parameter should be the seconds below which a stage is not compared")
+    parser.add_argument('--startup_tolerance', type=float, default=STARTUP_TOLERANCE,
+                        help="This parameter should be the seconds the startup can be slower than the baseline")
+    parser.add_argument('--startup_target', type=float, default=STARTUP_TARGET,
+                        help="This parameter should be the seconds of `Rules.py --help` above which the run fails")
+    parser.add_argument('--startup_runs', type=int, default=STARTUP_RUNS,
+                        help="This parameter should be the number of processes started to time the startup")
+    parser.add_argument('--tiers', type=str,
+                        help="This parameter should be the comma separated models to compare (e.g. sm,md,lg), "
+                             "the last one is the reference; the other stages are not run")
+    args = parser.parse_args()
+
+    if args.tiers is not None:
+        tiers = tier_report([tier for tier in args.tiers.split(',') if tier], args.parse_limit, args.batch_size)
+        print(tier_table(tiers))
+        with open(TIERS_REPORT_PATH, 'w', encoding='utf-8') as f:
+            json.dump(tiers, f, indent=2)
+        sys.exit(0)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    report = run(sizes, args.parse_limit, args.model, args.batch_size, args.startup_runs, args.repeats)
+    print(table(report))
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    failed = False
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print("Baseline saved to " + args.baseline)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold, args.min_seconds,
+                                  args.startup_tolerance)
+        if regressions:
+            print("Regressions beyond {:.0%}:".format(args.threshold))
+            for regression in regressions:
+                print("- " + regression)
+            failed = True
+        else:
+            print("No regressions beyond {:.0%} with respect to {}".format(args.threshold, args.baseline))
+
+    startup = next(stage for stage in report if stage['stage'] == 'startup:help')
+    if startup['p50_ms'] > args.startup_target * 1000:
+        print("Startup of {:.0f} ms beyond the target of {:.0f} ms".format(startup['p50_ms'],
+                                                                       args.startup_target * 1000))
+        failed = True
+    if failed:
+        sys.exit(1)
@@ -1,14 +1,21 @@
-import spacy
 import argparse
-import pandas as pd
-import yaml
+import contextlib
+import csv
+import multiprocessing
+import os
 import utils
+import lexicons
+import engine
+import parse_cache
+import token_array
+import rule_spec
+import profiling
+import lexical_prefilter
+from lexicons import FEMALE_NAME, MALE_NAME, SURNAME, MALE_CRAFT, FEMALE_CRAFT, male_pair_id, female_pair_id
 import sys
-
-sys.path.append('../search_tweets')
-
-import search_tweets
 import logging
+import time
+from collections import deque, OrderedDict
 
 """
 Rules.py:
@@ -57,227 +64,317 @@ nome_predicato_maschile(): This rule checks if a female proper noun is followed
 - male_expressions():       This rule checks if a common expression only referred to male gender is used, taking as a reference a corpus built by us. 
                             If this happens, a score of 0.25 is taken from the inclusiveness score.
                             ex. "Beati gli uomini di fede"
+spaCy, pandas, NumPy and the Twitter client are imported only by the functions that use them, and the model is
+loaded after the arguments are checked, so --help and the argument errors don't pay for them.
 """
 
-
-def male_female_jobs(tweet, male_list, female_list):
+MODEL_NAME = "it_core_news_lg"
+# the sizes of the Italian pipelines of spaCy, accepted by load_model() instead of the name of the package
+MODEL_TIERS = {'sm': "it_core_news_sm", 'md': "it_core_news_md", 'lg': "it_core_news_lg"}
+# pipeline components whose annotations are not read by any rule
+UNUSED_COMPONENTS = ["ner"]
+BATCH_SIZE = 256
+CHUNK_SIZE = 10000
+FLUSH_EVERY = 1000
+SHARD_SIZE = 1000
+# number of tweets evaluated together by the batch mode of the rules
+VECTOR_BATCH_SIZE = 4096
+# number of distinct cleaned tweets whose results are kept to be reused for their duplicates
+DEDUP_MEMO_SIZE = 100000
+# duplicates in a row after which one is scored anyway, see iter_dedup()
+DEDUP_MAX_RUN = 64
+# tweets not parsed in a row after which one is parsed anyway, see iter_parse()
+PREFILTER_MAX_RUN = 64
+RESULTS_PATH = '../../results.csv'
+PROFILE_PATH = '../../profile.json'
+RESULTS_COLUMNS = ['Tweet', 'inclusive_rate', 'explanation']
+
+# ids of the POS tags and of the dependency labels read by the rules (see token_array.py)
+POS_PROPN, POS_NOUN, POS_PRON, POS_DET, POS_AUX, POS_VERB = (
+    token_array.pos_id(tag) for tag in ('PROPN', 'NOUN', 'PRON', 'DET', 'AUX', 'VERB'))
+DEP_COMPOUND, DEP_COP, DEP_AUX, DEP_DET, DEP_ROOT = (
+    token_array.dep_id(label) for label in ('compound', 'cop', 'aux', 'det', 'ROOT'))
+
+
+# the spaCy model of the CLI and of the worker processes, used when a function is not given one
+nlp = None
+# the name of nlp, for the worker processes that load it again (see worker_pool())
+nlp_model = MODEL_NAME
+
+
+def load_model(model_name=MODEL_NAME):
+    """
+    Loads a spaCy model, given by tier (see MODEL_TIERS), package name or path, without UNUSED_COMPONENTS.
+    The word vectors are not read by the rules, but md and lg use them as features of the tagger and of the
+    parser, so they can't be dropped without changing the tags: sm is the tier without vectors.
+    """
+    import spacy
+    return spacy.load(MODEL_TIERS.get(model_name, model_name), exclude=UNUSED_COMPONENTS)
+
+
+def male_female_jobs(tweet):
     male_female_detected = False
     male_female_words_detected = []
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        doc = nlp(token)
-        for w in doc:
-            if tag == 'NOUN' and w.lemma_ in male_list:
-                if 'Number' in morph and morph['Number'] == 'Plur':
-                    pos = male_list.index(w.lemma_)
-                    for words in tweet:
-                        token_words, tag_words, det_words, morph_words = words
-                        doc_token = nlp(token_words)
-                        for d in doc_token:
-                            if tag_words == 'NOUN' and d.lemma_ in female_list:
-                                pos1 = female_list.index(d.lemma_)
-                                if pos == pos1:
-                                    if 'Number' in morph_words and morph_words['Number'] == 'Plur':
-                                        male_female_detected = True
-                                        male_female_words_detected.append(token)
-                                        male_female_words_detected.append(token_words)
+    # craft pair id -> plural nouns of the tweet whose lemma is the male (female) label of the pair
+    male_jobs = {}
+    female_jobs = {}
+    for idx in range(len(tweet)):
+        if tweet.pos[idx] == POS_NOUN and tweet.feats(idx).get('Number') == 'Plur':
+            lemma_classes = lexicons.classify(tweet.lemma[idx])
+            if lemma_classes & MALE_CRAFT:
+                male_jobs.setdefault(male_pair_id(lemma_classes), []).append(tweet.text[idx])
+            if lemma_classes & FEMALE_CRAFT:
+                female_jobs.setdefault(female_pair_id(lemma_classes), []).append(tweet.text[idx])
+
+    for pair, male_words in male_jobs.items():
+        if pair in female_jobs:
+            male_female_detected = True
+            male_female_words_detected.extend(male_words)
+            male_female_words_detected.extend(female_jobs[pair])
 
     return male_female_detected, male_female_words_detected
 
 
+def article_noun_at(tweet, idx):
+    if tweet.pos[idx] == POS_PROPN:
+        if tweet.classes[idx] & (SURNAME | FEMALE_NAME) and idx != 0:
+            if tweet.pos[idx - 1] == POS_DET:
+                morph = tweet.feats(idx - 1)
+                if 'Gender' in morph and 'PronType' in morph:
+                    if morph['Gender'] == 'Fem' and morph['PronType'] == 'Art':
+                        return True
+    return False
+
+
+def article_noun_vector(batch):
+    return ((batch.pos == POS_PROPN) & batch.has_class(SURNAME | FEMALE_NAME) & batch.valid(-1) &
+            (batch.shift(batch.pos, -1) == POS_DET) &
+            batch.shift(batch.feature('Gender', 'Fem') & batch.feature('PronType', 'Art'), -1))
+
+
 def article_noun(tweet, explain):
-    inclusive = 0.0
-    explanation = None
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        if tag == "PROPN":
-            if (utils.check_surname(str(token).lower()) or utils.check_female_name(str(token).lower())) and idx != 0:
-                if tweet[idx - 1][1] == 'DET':
-                    if 'Gender' in tweet[idx - 1][3] and 'PronType' in tweet[idx - 1][3]:
-                        if tweet[idx - 1][3]['Gender'] == 'Fem' and tweet[idx - 1][3]['PronType'] == 'Art':
-                            inclusive = -0.25
-                            if explain:
-                                explanation = "Utilizzare un articolo davanti ad un nome femminile diminuisce l'inclusività!"
+    return ARTICLE_NOUN.evaluate(None, tweet, explain)
 
-    return inclusive, explanation
 
+def femaleName_maleAppos_at(tweet, idx):
+    if tweet.pos[idx] == POS_PROPN and tweet.classes[idx] & FEMALE_NAME:
+        if idx + 1 < len(tweet):
+            if tweet.dep[idx + 1] == DEP_COMPOUND:
+                if tweet.classes[idx + 1] & MALE_CRAFT:
+                    return True
+    return False
 
-def femaleName_maleAppos(tweet, male_crafts, explain):
-    inclusive = 0.0
-    explanation = None
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        if tag == 'PROPN' and utils.check_female_name(token):
-            if idx + 1 < len(tweet):
-                if tweet[idx + 1][2] == 'compound':
-                    if tweet[idx + 1][0] in male_crafts:
-                        inclusive = - 0.25
-                        if explain:
-                            explanation = "Utilizzare un nome femminile con un'apposizione maschile diminuisce l'inclusività"
 
-    return inclusive, explanation
+def femaleName_maleAppos_vector(batch):
+    return ((batch.pos == POS_PROPN) & batch.has_class(FEMALE_NAME) & batch.valid(1) &
+            (batch.shift(batch.dep, 1) == DEP_COMPOUND) & batch.shift(batch.has_class(MALE_CRAFT), 1))
 
 
-def nome_predicato_maschile(tweet, male_crafts, explain):
-    inclusive = 0.0
-    explanation = None
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        if tag == 'PROPN' or tag == 'NOUN' and utils.check_female_name(token):
-            if idx + 3 < len(tweet):
-                if tweet[idx + 1][1] == 'AUX' and tweet[idx + 1][2] == 'cop':
-                    if tweet[idx + 3][0] in male_crafts:
-                        inclusive = - 0.25
-                        if explain:
-                            explanation = "Utilizzare un nome femminile con un nome del predicato maschile diminuisce l'inclusività"
+def femaleName_maleAppos(tweet, explain):
+    return FEMALENAME_MALEAPPOS.evaluate(None, tweet, explain)
 
-    return inclusive, explanation
 
+def nome_predicato_maschile_at(tweet, idx):
+    tag = tweet.pos[idx]
+    if tag == POS_PROPN or tag == POS_NOUN and tweet.classes[idx] & FEMALE_NAME:
+        if idx + 3 < len(tweet):
+            if tweet.pos[idx + 1] == POS_AUX and tweet.dep[idx + 1] == DEP_COP:
+                if tweet.classes[idx + 3] & MALE_CRAFT:
+                    return True
+    return False
 
-def art_donna_noun(tweet, crafts, explain):
-    inclusive = 0.0
-    explanation = None
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        if token == 'donna' and idx != 0:
-            if idx + 1 < len(tweet):
-                if tweet[idx + 1][1] == 'NOUN' and tweet[idx + 1][2] == 'compound':
-                    if tweet[idx + 1][0] in crafts:
-
-                        inclusive = - 0.25
-                        if explain:
-                            explanation = "Utilizzare il sostantivo 'donna' con un' apposizione maschile' diminuisce l'inclusività"
-    return inclusive, explanation
 
+def nome_predicato_maschile_vector(batch):
+    return (((batch.pos == POS_PROPN) | (batch.pos == POS_NOUN) & batch.has_class(FEMALE_NAME)) & batch.valid(3) &
+            (batch.shift(batch.pos, 1) == POS_AUX) & (batch.shift(batch.dep, 1) == DEP_COP) &
+            batch.shift(batch.has_class(MALE_CRAFT), 3))
 
-def maleAppos_femaleName(tweet, male_crafts, explain):
-    inclusive = 0.0
-    explanation = None
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        if token in male_crafts:
-            if idx + 1 < len(tweet):
-                if tweet[idx + 1][1] == 'PROPN' and utils.check_female_name(tweet[idx + 1][0]):
-                    inclusive = - 0.25
-                    if explain:
-                        explanation = "Utilizzare un'apposizione maschile con un nome femminile diminuisce l'inclusività"
-    return inclusive, explanation
 
+def nome_predicato_maschile(tweet, explain):
+    return NOME_PREDICATO_MASCHILE.evaluate(None, tweet, explain)
 
-def noun_donna(tweet, male_crafts, explain):
-    inclusive = 0.0
-    explanation = None
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        if token in male_crafts:
-            if idx + 1 < len(tweet):
-                if tweet[idx + 1][0] == 'donna':
-                    inclusive = - 0.25
-                    if explain:
-                        explanation = "Utilizzare un'apposizione maschile seguito da 'donna' diminuisce l'inclusività"
-    return inclusive, explanation
+
+def art_donna_noun_at(tweet, idx):
+    if tweet.text[idx] == 'donna' and idx != 0:
+        if idx + 1 < len(tweet):
+            if tweet.pos[idx + 1] == POS_NOUN and tweet.dep[idx + 1] == DEP_COMPOUND:
+                if tweet.classes[idx + 1] & MALE_CRAFT:
+                    return True
+    return False
+
+
+def art_donna_noun_vector(batch):
+    return (batch.text_in(['donna']) & (batch.position != 0) & batch.valid(1) &
+            (batch.shift(batch.pos, 1) == POS_NOUN) & (batch.shift(batch.dep, 1) == DEP_COMPOUND) &
+            batch.shift(batch.has_class(MALE_CRAFT), 1))
+
+
+def art_donna_noun(tweet, explain):
+    return ART_DONNA_NOUN.evaluate(None, tweet, explain)
+
+
+def maleAppos_femaleName_at(tweet, idx):
+    if tweet.classes[idx] & MALE_CRAFT:
+        if idx + 1 < len(tweet):
+            if tweet.pos[idx + 1] == POS_PROPN and tweet.classes[idx + 1] & FEMALE_NAME:
+                return True
+    return False
+
+
+def maleAppos_femaleName_vector(batch):
+    return (batch.has_class(MALE_CRAFT) & batch.valid(1) & (batch.shift(batch.pos, 1) == POS_PROPN) &
+            batch.shift(batch.has_class(FEMALE_NAME), 1))
+
+
+def maleAppos_femaleName(tweet, explain):
+    return MALEAPPOS_FEMALENAME.evaluate(None, tweet, explain)
+
+
+def noun_donna_at(tweet, idx):
+    if tweet.classes[idx] & MALE_CRAFT:
+        if idx + 1 < len(tweet):
+            if tweet.text[idx + 1] == 'donna':
+                return True
+    return False
+
+
+def noun_donna_vector(batch):
+    return batch.has_class(MALE_CRAFT) & batch.valid(1) & batch.shift(batch.text_in(['donna']), 1)
+
+
+def noun_donna(tweet, explain):
+    return NOUN_DONNA.evaluate(None, tweet, explain)
+
+
+def femaleSub_malePart_at(tweet, idx):
+    if tweet.pos[idx] == POS_AUX and tweet.dep[idx] == DEP_AUX:
+        morph = tweet.feats(idx)
+        if 'Person' in morph and 'Number' in morph:
+            if morph['Person'] == '3' and morph['Number'] == 'Sing':
+                if idx + 1 < len(tweet):
+                    if tweet.pos[idx + 1] == POS_VERB and tweet.dep[idx + 1] == DEP_ROOT:
+                        if 'Gender' in morph and 'VerbForm' in morph and 'Number' in morph:
+                            next_morph = tweet.feats(idx + 1)
+                            if next_morph.get('Gender') == 'Masc' and next_morph.get('VerbForm') == 'Part' and \
+                                    next_morph.get('Number') == 'Sing':
+                                return True
+    return False
+
+
+def femaleSub_malePart_vector(batch):
+    candidate = ((batch.pos == POS_AUX) & (batch.dep == DEP_AUX) & batch.feature('Person', '3') &
+                 batch.feature('Number', 'Sing') & batch.valid(1) & (batch.shift(batch.pos, 1) == POS_VERB) &
+                 (batch.shift(batch.dep, 1) == DEP_ROOT) & batch.feature('Gender') & batch.feature('VerbForm'))
+    return candidate & batch.shift(batch.feature('Gender', 'Masc') & batch.feature('VerbForm', 'Part') &
+                                   batch.feature('Number', 'Sing'), 1)
 
 
 def femaleSub_malePart(tweet, explain):
-    inclusive = 0.0
-    explanation = None
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        if tag == 'PROPN' or tag == 'NOUN' and det == 'nsubj':
-            continue
-        if tag == 'AUX' and det == 'aux':
-            if 'Person' in morph and 'Number' in morph:
-                if morph['Person'] == '3' and morph['Number'] == 'Sing':
-                    if idx + 1 < len(tweet):
-                        if tweet[idx + 1][1] == 'VERB' and tweet[idx + 1][2] == 'ROOT':
-                            if 'Gender' in morph and 'VerbForm' in morph and 'Number' in morph:
-                                if tweet[idx + 1][3]['Gender'] == 'Masc' and tweet[idx + 1][3]['VerbForm'] == 'Part' and \
-                                        tweet[idx + 1][3]['Number'] == 'Sing':
-                                    inclusive = - 0.25
-                                    if explain:
-                                        explanation = "Utilizzare un sostantivo femminile con un verbo al maschile diminuisce l'inclusività"
-    return inclusive, explanation
+    return FEMALESUB_MALEPART.evaluate(None, tweet, explain)
+
+
+def pronoun_inclusive_at(tweet, idx):
+    tag = tweet.pos[idx]
+    if tag == POS_PRON or tag == POS_NOUN:
+        morph = tweet.feats(idx)
+        if 'Gender' in morph:
+            if morph['Gender'] == 'Masc':
+                if idx + 2 < len(tweet):
+                    if tweet.text[idx + 1] == '/' or tweet.text[idx + 1] == '\\':
+                        if 'Gender' in tweet.feats(idx + 2):
+                            if tweet.pos[idx + 2] == POS_PRON or tweet.pos[idx + 2] == POS_NOUN and \
+                                    tweet.feats(idx + 2)['Gender'] == 'Fem':
+                                return True
+    return False
+
+
+def pronoun_inclusive_vector(batch):
+    return (((batch.pos == POS_PRON) | (batch.pos == POS_NOUN)) & batch.feature('Gender', 'Masc') & batch.valid(2) &
+            batch.shift(batch.text_in(['/', '\\']), 1) & batch.shift(batch.feature('Gender'), 2) &
+            batch.shift((batch.pos == POS_PRON) | (batch.pos == POS_NOUN) & batch.feature('Gender', 'Fem'), 2))
 
 
 def pronoun_inclusive(tweet, explain):
-    inclusive = 0.0
-    explanation = None
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        if tag == 'PRON' or tag == 'NOUN':
-            if 'Gender' in morph:
-                if morph['Gender'] == 'Masc':
-                    if idx + 2 < len(tweet):
-                        if tweet[idx + 1][0] == '/' or tweet[idx + 1][0] == '\\':
-                            if 'Gender' in tweet[idx + 2][3]:
-                                if tweet[idx + 2][1] == 'PRON' or tweet[idx + 2][1] == 'NOUN' and tweet[idx + 2][3][
-                                    'Gender'] == 'Fem':
-                                    inclusive = 0.10
-                                    if explain:
-                                        explanation = "Utilizzare i pronomi declinati in più forme aumenta l'inclusività"
-    return inclusive, explanation
+    return PRONOUN_INCLUSIVE.evaluate(None, tweet, explain)
+
+
+def article_inclusive_at(tweet, idx):
+    if tweet.pos[idx] == POS_DET and tweet.dep[idx] == DEP_DET:
+        morph = tweet.feats(idx)
+        if 'Gender' in morph:
+            if morph['Gender'] == 'Masc':
+                if idx + 2 < len(tweet):
+                    if tweet.text[idx + 1] == '/' or tweet.text[idx + 1] == '\\':
+                        if 'Gender' in tweet.feats(idx + 2):
+                            if tweet.pos[idx + 2] == POS_DET and tweet.dep[idx + 2] == DEP_DET and \
+                                    tweet.feats(idx + 2)['Gender'] == 'Fem':
+                                return True
+    return False
+
+
+def article_inclusive_vector(batch):
+    det = (batch.pos == POS_DET) & (batch.dep == DEP_DET)
+    return (det & batch.feature('Gender', 'Masc') & batch.valid(2) & batch.shift(batch.text_in(['/', '\\']), 1) &
+            batch.shift(det & batch.feature('Gender', 'Fem'), 2))
 
 
 def article_inclusive(tweet, explain):
-    inclusive = 0.0
-    explanation = None
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        if tag == 'DET' and det == 'det':
-            if 'Gender' in morph:
-                if morph['Gender'] == 'Masc':
-                    if idx + 2 < len(tweet):
-                        if tweet[idx + 1][0] == '/' or tweet[idx + 1][0] == '\\':
-                            if 'Gender' in tweet[idx + 2][3]:
-                                if tweet[idx + 2][1] == 'DET' and tweet[idx + 2][2] == 'det' and tweet[idx + 2][3][
-                                    'Gender'] == 'Fem':
-                                    inclusive = 0.10
-                                    if explain:
-                                        explanation = "Utilizzare gli articoli declinati in più forme aumenta l'inclusività"
-    return inclusive, explanation
+    return ARTICLE_INCLUSIVE.evaluate(None, tweet, explain)
+
+
+def words_ends_with2gender_at(tweet, idx):
+    token = tweet.text[idx]
+    if token == '/' or token == '\\':
+        if idx + 1 < len(tweet):
+            if tweet.text[idx + 1] == 'a' or tweet.text[idx + 1] == 'e':
+                return True
+    return False
+
+
+def words_ends_with2gender_vector(batch):
+    return batch.text_in(['/', '\\']) & batch.valid(1) & batch.shift(batch.text_in(['a', 'e']), 1)
 
 
 def words_ends_with2gender(tweet, explain):
-    inclusive = 0.0
-    explanation = None
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        if token == '/' or token == '\\':
-            if idx + 1 < len(tweet):
-                if tweet[idx + 1][0] == 'a' or tweet[idx + 1][0] == 'e':
-                    inclusive = 0.10
-                    if explain:
-                        explanation = "Utilizzare parole declinate in più forme aumenta l'inclusività"
-    return inclusive, explanation
+    return WORDS_ENDS_WITH2GENDER.evaluate(None, tweet, explain)
+
+
+def schwa_at(tweet, idx):
+    token = tweet.text[idx]
+    return token.endswith('*') or token.endswith('ə')
+
+
+def schwa_vector(batch):
+    return batch.text_endswith(['*', 'ə'])
 
 
 def schwa(tweet, explain):
-    inclusive = 0.0
-    explanation = None
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        if token.endswith('*') or token.endswith('ə'):
-            inclusive = 0.25
-            if explain:
-                explanation = "Utilizzare caratteri come la schwa o l'asterisco alla fine di una parola aumenta l'inclusività"
-    return inclusive, explanation
+    return SCHWA.evaluate(None, tweet, explain)
 
 
-def male_collettives(tweet, male_list, explain):
+def male_collettives(tweet, explain):
     inclusive = 0.0
     pl_male_job = []
     counter_propn = 0
     explanation = None
 
-    male_female_detected, male_female_words_detected = male_female_jobs(tweet, male_list, female_list)
+    male_female_detected, male_female_words_detected = male_female_jobs(tweet)
     if male_female_detected == True:
         inclusive += 0.25
         if explain:
             logging.info(male_female_detected, male_female_words_detected)
             explanation = "Utilizzare sia mestiere maschile plurale che il corrispettivo femminile aumenta l'inclusività!"
 
-    for idx, (token, tag, det, morph) in enumerate(tweet):
-        doc = nlp(token)
-
-        w = [tok for tok in doc]
-        if tag == 'NOUN' and w[0].lemma_ in male_list:
-            if 'Number' in morph and morph['Number'] == 'Plur':
+    for idx in range(len(tweet)):
+        if tweet.pos[idx] == POS_NOUN and lexicons.classify(tweet.lemma[idx]) & MALE_CRAFT:
+            if tweet.feats(idx).get('Number') == 'Plur':
 
-                pl_male_job.append(token)
-                for word in tweet:
-                    token_word, tag_word, det_word, morph_word = word
-                    if tag_word == "PROPN" or tag_word == "NOUN":
+                pl_male_job.append(tweet.text[idx])
+                for idx_word in range(len(tweet)):
+                    tag_word = tweet.pos[idx_word]
+                    if tag_word == POS_PROPN or tag_word == POS_NOUN:
 
-                        if utils.check_male_name(
-                                token_word):
+                        if tweet.classes[idx_word] & MALE_NAME:
                             counter_propn = counter_propn + 1
 
     for job in pl_male_job:
@@ -292,139 +389,613 @@ def male_collettives(tweet, male_list, explain):
     return inclusive, explanation
 
 
+def male_collettives_vector(batch):
+    # male_collettives() scores only tweets with a plural noun whose lemma is a craft
+    nouns = (batch.pos == POS_NOUN) & batch.feature('Number', 'Plur')
+    return batch.lemma_has_class(MALE_CRAFT | FEMALE_CRAFT, nouns)
+
+
+def find_male_expressions(sentence):
+    if " di paternità" in sentence:
+        return []
+    return lexicons.get().male_expressions_matcher.findall(str(sentence).lower())
+
+
 def male_expressions(sentence, explain):
-    with open('docs/uomini_di.txt', 'r', encoding='utf-8') as f:
-        myExpressions = set(line.strip() for line in f)
     inclusive = 0.0
     explanation = None
-    for expression in myExpressions:
-        if " di paternità" not in sentence:
-            if str(expression).lower() in str(sentence).lower():
-                inclusive = - 0.25
-                if explain:
-                    explanation = "Utilizzare espressioni comuni riferite solo agli uomini diminuisce l'inclusività"
+    found = find_male_expressions(sentence)
+    if found:
+        inclusive = - 0.25
+        if explain:
+            logging.info(found)
+            explanation = "Utilizzare espressioni comuni riferite solo agli uomini diminuisce l'inclusività"
 
     return inclusive, explanation
 
 
-def save_postag(df):
+# spaCy Matcher patterns of the pattern rules (see matcher_engine.py)
+SLASH = {"ORTH": {"IN": ["/", "\\"]}}
+MALE_CRAFT_TOKEN = {"_": {"lex_male_craft": True}}
+FEMALE_NAME_PROPN = {"POS": "PROPN", "_": {"lex_female_name": True}}
+FEM_ARTICLE = {"POS": "DET", "MORPH": {"IS_SUPERSET": ["Gender=Fem", "PronType=Art"]}}
+COPULA = {"POS": "AUX", "DEP": "cop"}
+HAS_GENDER = "(^|\\|)Gender="
+
+# Pattern rules: each one adds its score once if its pattern matches on at least one token of the tweet.
+# tags are the POS tags of the token where the pattern is anchored (None: any tag), used by the fused engine.
+WORDS_ENDS_WITH2GENDER = engine.TokenRule(
+    'words_ends_with2gender', words_ends_with2gender_at, 0.10,
+    "Utilizzare parole declinate in più forme aumenta l'inclusività",
+    vector=words_ends_with2gender_vector,
+    patterns=[[SLASH, {"ORTH": {"IN": ["a", "e"]}}]])
+SCHWA = engine.TokenRule(
+    'schwa', schwa_at, 0.25,
+    "Utilizzare caratteri come la schwa o l'asterisco alla fine di una parola aumenta l'inclusività",
+    vector=schwa_vector,
+    patterns=[[{"TEXT": {"REGEX": "[*ə]\\Z"}}]])
+ARTICLE_NOUN = engine.TokenRule(
+    'article_noun', article_noun_at, -0.25,
+    "Utilizzare un articolo davanti ad un nome femminile diminuisce l'inclusività!", tags=['PROPN'],
+    vector=article_noun_vector,
+    patterns=[[FEM_ARTICLE, {"POS": "PROPN", "_": {"lex_surname": True}}],
+              [FEM_ARTICLE, FEMALE_NAME_PROPN]])
+PRONOUN_INCLUSIVE = engine.TokenRule(
+    'pronoun_inclusive', pronoun_inclusive_at, 0.10,
+    "Utilizzare i pronomi declinati in più forme aumenta l'inclusività", tags=['PRON', 'NOUN'],
+    vector=pronoun_inclusive_vector,
+    patterns=[[{"POS": {"IN": ["PRON", "NOUN"]}, "MORPH": {"IS_SUPERSET": ["Gender=Masc"]}}, SLASH, third]
+              for third in ({"POS": "PRON", "MORPH": {"REGEX": HAS_GENDER}},
+                            {"POS": "NOUN", "MORPH": {"IS_SUPERSET": ["Gender=Fem"]}})])
+FEMALENAME_MALEAPPOS = engine.TokenRule(
+    'femaleName_maleAppos', femaleName_maleAppos_at, - 0.25,
+    "Utilizzare un nome femminile con un'apposizione maschile diminuisce l'inclusività", tags=['PROPN'],
+    vector=femaleName_maleAppos_vector,
+    patterns=[[FEMALE_NAME_PROPN, dict(MALE_CRAFT_TOKEN, DEP="compound")]])
+ART_DONNA_NOUN = engine.TokenRule(
+    'art_donna_noun', art_donna_noun_at, - 0.25,
+    "Utilizzare il sostantivo 'donna' con un' apposizione maschile' diminuisce l'inclusività",
+    vector=art_donna_noun_vector,
+    patterns=[[{}, {"ORTH": "donna"}, dict(MALE_CRAFT_TOKEN, POS="NOUN", DEP="compound")]])
+NOUN_DONNA = engine.TokenRule(
+    'noun_donna', noun_donna_at, - 0.25,
+    "Utilizzare un'apposizione maschile seguito da 'donna' diminuisce l'inclusività",
+    vector=noun_donna_vector,
+    patterns=[[MALE_CRAFT_TOKEN, {"ORTH": "donna"}]])
+FEMALESUB_MALEPART = engine.TokenRule(
+    'femaleSub_malePart', femaleSub_malePart_at, - 0.25,
+    "Utilizzare un sostantivo femminile con un verbo al maschile diminuisce l'inclusività", tags=['AUX'],
+    vector=femaleSub_malePart_vector,
+    patterns=[[{"POS": "AUX", "DEP": "aux",
+                "MORPH": {"IS_SUPERSET": ["Number=Sing", "Person=3"],
+                          "REGEX": "^(?=(.*\\|)?Gender=)(?=(.*\\|)?VerbForm=)"}},
+               {"POS": "VERB", "DEP": "ROOT",
+                "MORPH": {"IS_SUPERSET": ["Gender=Masc", "Number=Sing", "VerbForm=Part"]}}]])
+MALEAPPOS_FEMALENAME = engine.TokenRule(
+    'maleAppos_femaleName', maleAppos_femaleName_at, - 0.25,
+    "Utilizzare un'apposizione maschile con un nome femminile diminuisce l'inclusività",
+    vector=maleAppos_femaleName_vector,
+    patterns=[[MALE_CRAFT_TOKEN, FEMALE_NAME_PROPN]])
+ARTICLE_INCLUSIVE = engine.TokenRule(
+    'article_inclusive', article_inclusive_at, 0.10,
+    "Utilizzare gli articoli declinati in più forme aumenta l'inclusività", tags=['DET'],
+    vector=article_inclusive_vector,
+    patterns=[[{"POS": "DET", "DEP": "det", "MORPH": {"IS_SUPERSET": ["Gender=Masc"]}}, SLASH,
+               {"POS": "DET", "DEP": "det", "MORPH": {"IS_SUPERSET": ["Gender=Fem"]}}]])
+NOME_PREDICATO_MASCHILE = engine.TokenRule(
+    'nome_predicato_maschile', nome_predicato_maschile_at, - 0.25,
+    "Utilizzare un nome femminile con un nome del predicato maschile diminuisce l'inclusività",
+    tags=['PROPN', 'NOUN'],
+    vector=nome_predicato_maschile_vector,
+    patterns=[[{"POS": "PROPN"}, COPULA, {}, MALE_CRAFT_TOKEN],
+              [{"POS": "NOUN", "_": {"lex_female_name": True}}, COPULA, {}, MALE_CRAFT_TOKEN]])
+
+# all the rules, in the order of the scores and explanations of a tweet
+RULES = [
+    WORDS_ENDS_WITH2GENDER,
+    SCHWA,
+    ARTICLE_NOUN,
+    PRONOUN_INCLUSIVE,
+    FEMALENAME_MALEAPPOS,
+    ART_DONNA_NOUN,
+    NOUN_DONNA,
+    FEMALESUB_MALEPART,
+    MALEAPPOS_FEMALENAME,
+    ARTICLE_INCLUSIVE,
+    engine.TweetRule('male_collettives', lambda sentence, tweet, explain: male_collettives(tweet, explain),
+                     vector=male_collettives_vector),
+    NOME_PREDICATO_MASCHILE,
+    engine.TweetRule('male_expressions', lambda sentence, tweet, explain: male_expressions(sentence, explain)),
+]
+RULE_SET = rule_spec.RuleSet(RULES)
+ENGINE = RULE_SET.engine
+
+# the spec file of the rules loaded with load_rules(), None to use RULES
+rule_file = None
+
+
+def load_rules(path):
+    """
+    Uses the rules of a spec file (see rule_spec.py) instead of RULES. The rules of RULES can be
+    referenced in the spec by name ('builtin'); the file is compiled again when it changes.
+    """
+    global rule_file
+    rule_file = rule_spec.RuleFile(path, builtins={rule.name: rule for rule in RULES})
+    return rule_file
+
+
+def rule_set():
+    if rule_file is None:
+        return RULE_SET
+    return rule_file.current()
+
+
+# the profiling.Profiler of the --profile mode, None when not profiling
+profiler = None
+
+
+# the lexical_prefilter.Prefilter of the --prefilter mode, None to parse every tweet
+prefilter = None
+# the parse of the tweets not parsed: every rule scores 0.0 on it
+EMPTY_PARSE = token_array.TokenArray.from_tokens([])
+
+
+def profiled(stage, iterable):
+    # the iterable itself when not profiling, so the stages cost nothing
+    if profiler is None:
+        return iterable
+    return profiler.iterate(stage, iterable)
+
+
+def profiled_stage(stage):
+    if profiler is None:
+        return contextlib.nullcontext()
+    return profiler.stage(stage)
+
+
+def report_profile(path=PROFILE_PATH):
+    profiler.save(path)
+    logging.info(profiler.report())
+    print(profiler.table())
+    print("Profile saved to " + path)
+
+
+def report_throughput(n_tweets, seconds, stage='Parsed'):
+    rate = n_tweets / seconds if seconds > 0 else float('inf')
+    message = "{} {} tweets in {:.2f} s ({:.1f} tweets/s)".format(stage, n_tweets, seconds, rate)
+    logging.info(message)
+    print(message)
+
+
+def report_cache(cache):
+    message = "Parse cache: {} hits, {} parsed".format(cache.hits, cache.misses)
+    logging.info(message)
+    print(message)
+
+
+def iter_postag(tweets, batch_size=BATCH_SIZE, n_process=1, throughput=False, cache=None, matcher=False, model=None):
+    """
+    Cleans and parses the tweets lazily, yielding (cleaned tweet, token_array.TokenArray) in input order:
+    only batch_size tweets at a time are held by the parser.
+    With a parse_cache.ParseCache only the tweets never seen before are parsed.
+    With matcher the pattern rules are matched on each doc by the spaCy Matcher while it is parsed
+    (see matcher_engine.py); the tweets read from the cache are not matched.
+    The tweets are parsed by model, or by the global nlp if it's None.
+    """
+    cleaned = profiled('cleaning', (utils.clean_tweet(t) for t in tweets))
+    return iter_parse(cleaned, batch_size, n_process, throughput, cache, matcher, model)
+
+
+def iter_parse(cleaned, batch_size=BATCH_SIZE, n_process=1, throughput=False, cache=None, matcher=False, model=None):
+    """
+    Parses tweets already cleaned by utils.clean_tweet, as iter_postag().
+    With a lexical_prefilter.Prefilter in prefilter the tweets no rule can fire on are not parsed
+    (see _iter_prefiltered()).
+    """
+    model = nlp if model is None else model
+    if prefilter is None:
+        return profiled('parsing', _iter_parse(cleaned, batch_size, n_process, throughput, cache, matcher, model))
+    return profiled('parsing', _iter_prefiltered(
+        cleaned, lambda texts: _iter_parse(texts, batch_size, n_process, throughput, cache, matcher, model)))
+
+
+def _iter_prefiltered(cleaned, parse, max_run=PREFILTER_MAX_RUN):
+    """
+    Sends to parse() only the tweets with a trigger of the prefilter, and yields the other ones with EMPTY_PARSE
+    in their place. After max_run tweets not parsed in a row one is parsed anyway, so the tweets waiting for
+    the parser are bounded. In validate mode every tweet is parsed, and the ones without triggers that score
+    are counted and logged.
+    """
+    # (True, whether to validate it) for a tweet sent to parse(), (False, tweet) for a tweet not parsed
+    pending = deque()
+
+    def to_parse():
+        run = 0
+        for text in cleaned:
+            prefilter.tweets += 1
+            if not prefilter.may_score(text):
+                if prefilter.validate:
+                    prefilter.bypassed += 1
+                    pending.append((True, True))
+                    yield text
+                    continue
+                if run < max_run:
+                    prefilter.bypassed += 1
+                    run += 1
+                    pending.append((False, text))
+                    continue
+            run = 0
+            pending.append((True, False))
+            yield text
+
+    for sentence, phrase in parse(to_parse()):
+        parsed, value = pending.popleft()
+        while not parsed:
+            yield value, EMPTY_PARSE
+            parsed, value = pending.popleft()
+        if value and any(score != 0 for score, explanation in rule_set().engine.evaluate(sentence, phrase, False)):
+            prefilter.violations += 1
+            logging.warning("Prefilter: tweet without triggers that scores: %s", sentence)
+        yield sentence, phrase
+    for parsed, text in pending:
+        yield text, EMPTY_PARSE
+
+
+def _iter_parse(cleaned, batch_size, n_process, throughput, cache, matcher, model):
+    n_tweets = 0
+    start = time.perf_counter()
+    if cache is None:
+        for doc in model.pipe(cleaned, batch_size=batch_size, n_process=n_process):
+            n_tweets += 1
+            matches = rule_set().matcher_engine.matches(doc) if matcher else None
+            yield doc.text, token_array.TokenArray.from_doc(doc, matches)
+    else:
+        for sentence, tokens, doc in cache.parse(model, cleaned, batch_size, n_process):
+            n_tweets += 1
+            if doc is None:
+                yield sentence, token_array.TokenArray.from_tokens(tokens)
+            else:
+                matches = rule_set().matcher_engine.matches(doc) if matcher else None
+                yield sentence, token_array.TokenArray.from_doc(doc, matches)
+    if throughput:
+        report_throughput(n_tweets, time.perf_counter() - start)
+        if cache is not None:
+            report_cache(cache)
+
+
+def save_postag(df, batch_size=BATCH_SIZE, n_process=1, throughput=False, cache=None, model=None):
     tweets = []
     pos_tagging = []
-    for t in df['Tweet']:
-        result = utils.clean_tweet(t)
-        tweets.append(result)
-        doc = nlp(result)
-        phrase_pos = []
-        for token in doc:
-            phrase_dict = {}
-            for j in token.morph:
-                if len(j) != 0:
-                    couple_list = j.split('=')
-                    phrase_dict[couple_list[0]] = couple_list[1]
-            phrase_pos.append((token.text, token.pos_, token.dep_, phrase_dict))
+    for sentence, phrase_pos in iter_postag(df['Tweet'], batch_size, n_process, throughput, cache, model=model):
+        tweets.append(sentence)
         pos_tagging.append(phrase_pos)
     return tweets, pos_tagging
 
 
-def rules(sentences, ph, explain):
-    d = []
-    for sentence, phrase in zip(sentences, ph):
-        scores = []
-        explanations = []
-
-        score, explanation = words_ends_with2gender(phrase, explain)
-        scores.append(score)
-        explanations.append(explanation)
-
-        score, explanation = schwa(phrase, explain)
-        scores.append(score)
-        explanations.append(explanation)
+def score_phrase(sentence, phrase, explain):
+    rules = rule_set()
+    if profiler is not None:
+        # the rules one at a time, to time each of them
+        return phrase_result(sentence, phrase, profiler.evaluate(rules.rules, sentence, phrase, explain))
+    rule_engine = rules.engine if phrase.matches is None else rules.matcher_engine
+    return phrase_result(sentence, phrase, rule_engine.evaluate(sentence, phrase, explain))
 
-        score, explanation = article_noun(phrase, explain)
-        scores.append(score)
-        explanations.append(explanation)
 
-        score, explanation = pronoun_inclusive(phrase, explain)
+def phrase_result(sentence, phrase, rule_results):
+    scores = []
+    explanations = []
+    for score, explanation in rule_results:
         scores.append(score)
         explanations.append(explanation)
 
-        score, explanation = femaleName_maleAppos(phrase, male_crafts, explain)
-        scores.append(score)
-        explanations.append(explanation)
-
-        score, explanation = art_donna_noun(phrase, male_crafts, explain)
-        scores.append(score)
-        explanations.append(explanation)
-
-        score, explanation = noun_donna(phrase, male_crafts, explain)
-        scores.append(score)
-        explanations.append(explanation)
-
-        score, explanation = femaleSub_malePart(phrase, explain)
-        scores.append(score)
-        explanations.append(explanation)
-
-        score, explanation = maleAppos_femaleName(phrase, male_crafts, explain)
-        scores.append(score)
-        explanations.append(explanation)
-
-        score, explanation = article_inclusive(phrase, explain)
-        scores.append(score)
-        explanations.append(explanation)
+    inclusive = sum(scores)
+    explanations = [x for x in explanations if x is not None]
+
+    new_sentence = sentence.replace("\n", " ")
+    new_sentence = new_sentence.replace("\t", " ")
+    new_sentence = new_sentence.replace("\r", " ")
+    new_sentence = new_sentence.replace(",", " ")
+    new_sentence = new_sentence.replace(";", " ")
+    # new_sentence = new_sentence.replace("\"", " ")
+
+    logging.info(new_sentence)
+    logging.info(phrase)
+    logging.info(inclusive)
+    logging.info(explanations)
+
+    return {
+        'Tweet': new_sentence,
+        'inclusive_rate': inclusive,
+        'explanation': explanations
+    }
+
+
+def iter_rules(parsed, explain, vectorized=False):
+    """
+    Scores the parsed tweets, yielding their results in input order.
+    With vectorized the rules are evaluated on VECTOR_BATCH_SIZE tweets at a time (see vector_engine.py),
+    with the same results. When profiling the rules are always evaluated tweet by tweet, see score_phrase().
+    """
+    return profiled('rules', _iter_rules(parsed, explain, vectorized))
+
+
+def _iter_rules(parsed, explain, vectorized):
+    if not vectorized or profiler is not None:
+        for sentence, phrase in parsed:
+            yield score_phrase(sentence, phrase, explain)
+        return
+    for batch in _shards(parsed, VECTOR_BATCH_SIZE):
+        sentences = [sentence for sentence, phrase in batch]
+        phrases = [phrase for sentence, phrase in batch]
+        for sentence, phrase, rule_results in zip(sentences, phrases,
+                                                  rule_set().vector_engine.evaluate_batch(sentences, phrases,
+                                                                                          explain)):
+            yield phrase_result(sentence, phrase, rule_results)
+
+
+# default output of rules(), that writes to RESULTS_PATH as it is when called (None doesn't write)
+DEFAULT_OUTPUT = object()
+
+
+def rules(sentences, ph, explain, scores=None, user=None, output=DEFAULT_OUTPUT):
+    """
+    Scores the parsed tweets. With a utils.UserScores in scores their scores are added to the ones of user;
+    without output the results are not written to a csv.
+    """
+    if output is DEFAULT_OUTPUT:
+        output = RESULTS_PATH
+    results = iter_rules(zip(sentences, ph), explain)
+    if scores is not None:
+        results = scores.feed(user, results)
+    d = list(results)
+    if output is not None:
+        import pandas as pd
+        pd.DataFrame(d).to_csv(output, sep=',', encoding='utf-8-sig', index=False)
+    return d
 
-        score, explanation = male_collettives(phrase, male_list, explain)
-        scores.append(score)
-        explanations.append(explanation)
 
-        score, explanation = nome_predicato_maschile(phrase, male_crafts, explain)
-        scores.append(score)
-        explanations.append(explanation)
-
-        score, explanation = male_expressions(sentence, explain)
-        scores.append(score)
-        explanations.append(explanation)
-
-        inclusive = sum(scores)
-        explanations = [x for x in explanations if x is not None]
-
-        new_sentence = sentence.replace("\n", " ")
-        new_sentence = new_sentence.replace("\t", " ")
-        new_sentence = new_sentence.replace("\r", " ")
-        new_sentence = new_sentence.replace(",", " ")
-        new_sentence = new_sentence.replace(";", " ")
-        # new_sentence = new_sentence.replace("\"", " ")
-
-        d.append(
-            {
-                'Tweet': new_sentence,
-                'inclusive_rate': inclusive,
-                'explanation': explanations
-            }
-        )
-
-        logging.info(new_sentence)
-        logging.info(phrase)
-        logging.info(inclusive)
-        logging.info(explanations)
-
-    pd.DataFrame(d).to_csv('../../results.csv', sep=',', encoding='utf-8-sig', index=False)
-    return d
+def read_tweets(path_csv, chunksize=CHUNK_SIZE):
+    import pandas as pd
+    for chunk in pd.read_csv(path_csv, chunksize=chunksize):
+        for t in chunk['Tweet']:
+            yield t
+
+
+def write_results(results, output=RESULTS_PATH, flush_every=FLUSH_EVERY):
+    """
+    Appends the results to the csv while they are produced, in the same format of rules(),
+    flushing the file every flush_every tweets. Returns the number of tweets written.
+    """
+    n_results = 0
+    with profiled_stage('writing'), open(output, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, lineterminator=os.linesep)
+        writer.writerow(RESULTS_COLUMNS)
+        for result in results:
+            writer.writerow([result[column] for column in RESULTS_COLUMNS])
+            n_results += 1
+            if n_results % flush_every == 0:
+                f.flush()
+    if profiler is not None:
+        profiler.count('writing', n_results)
+    return n_results
+
+
+def _init_worker(model_name, rules_path=None, profile=False, prefilter_mode=None):
+    # with fork the workers inherit the model, the lexicons and the rules already loaded by the parent;
+    # prefilter_mode is None without prefilter, else whether it validates
+    global nlp, profiler, prefilter
+    if nlp is None:
+        nlp = load_model(model_name)
+    lexicons.get()
+    if rules_path is not None and rule_file is None:
+        load_rules(rules_path)
+    if profile and profiler is None:
+        profiler = profiling.Profiler()
+    if prefilter_mode is not None and prefilter is None:
+        prefilter = lexical_prefilter.Prefilter(prefilter_mode)
+
+
+def score_shard(tweets, explain, batch_size=BATCH_SIZE, cache=None, cleaned=False, vectorized=False, matcher=False):
+    if cleaned:
+        return list(iter_rules(iter_parse(tweets, batch_size, cache=cache, matcher=matcher), explain, vectorized))
+    return list(iter_rules(iter_postag(tweets, batch_size, cache=cache, matcher=matcher), explain, vectorized))
+
+
+def _counted_shard(tweets, explain, batch_size=BATCH_SIZE, cache=None, *args):
+    # the results of score_shard() with the counters of the profiler, of the prefilter and of the cache
+    # of the worker for this shard only
+    if profiler is not None:
+        profiler.snapshot(reset=True)
+    if prefilter is not None:
+        prefilter.take()
+    if cache is not None:
+        cache.take()
+    results = score_shard(tweets, explain, batch_size, cache, *args)
+    return (results, profiler.snapshot(reset=True) if profiler is not None else None,
+            prefilter.take() if prefilter is not None else None, cache.take() if cache is not None else None)
+
+
+def _shards(tweets, shard_size):
+    shard = []
+    for t in tweets:
+        shard.append(t)
+        if len(shard) == shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def worker_pool(workers):
+    """
+    The pool is forked after the model is loaded, so its pages are shared copy-on-write by the workers.
+    """
+    method = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+    context = multiprocessing.get_context(method)
+    rules_path = rule_file.path if rule_file is not None else None
+    prefilter_mode = prefilter.validate if prefilter is not None else None
+    return context.Pool(workers, initializer=_init_worker,
+                        initargs=(nlp_model, rules_path, profiler is not None, prefilter_mode))
+
+
+def iter_rules_parallel(tweets, explain, pool, workers, shard_size=SHARD_SIZE, batch_size=BATCH_SIZE, cache=None,
+                        cleaned=False, vectorized=False, matcher=False):
+    """
+    Scores the tweets in the worker_pool(), shard_size tweets per task, and yields the results
+    in input order. At most 2 * workers shards are in flight, so memory stays bounded.
+    The counters of the profiler, of the prefilter and of the cache of the workers are merged into the ones
+    of the parent.
+    """
+    pending = deque()
+    counted = profiler is not None or prefilter is not None or cache is not None
+    task = _counted_shard if counted else score_shard
+    for shard in _shards(tweets, shard_size):
+        pending.append(pool.apply_async(task, (shard, explain, batch_size, cache, cleaned, vectorized, matcher)))
+        if len(pending) >= 2 * workers:
+            for result in _shard_results(pending.popleft().get(), counted, cache):
+                yield result
+    while pending:
+        for result in _shard_results(pending.popleft().get(), counted, cache):
+            yield result
+
+
+def _shard_results(results, counted, cache):
+    if not counted:
+        return results
+    results, snapshot, counts, cache_counts = results
+    if snapshot is not None:
+        profiler.merge(snapshot)
+    if counts is not None:
+        prefilter.merge(counts)
+    if cache_counts is not None:
+        cache.merge(cache_counts)
+    return results
+
+
+class DedupStats:
+
+    def __init__(self):
+        self.tweets = 0
+        self.scored = 0
+
+    @property
+    def ratio(self):
+        # fraction of the tweets that were not parsed and scored because duplicates
+        return 1 - self.scored / self.tweets if self.tweets else 0.0
+
+    def report(self):
+        message = "Deduplicated {} tweets, {} of them scored (dedup ratio {:.1%})".format(self.tweets, self.scored,
+                                                                                        self.ratio)
+        logging.info(message)
+        print(message)
+
+
+def iter_dedup(cleaned, score_distinct, stats, memo_size=DEDUP_MEMO_SIZE, max_run=DEDUP_MAX_RUN):
+    """
+    Scores each distinct cleaned tweet once and yields its result for every copy of it, in input order.
+    score_distinct(texts) is called once, on a stream of the distinct texts, and yields their results in the
+    same order, so the parser and the workers are started once per run. The results of the last memo_size
+    distinct texts are kept, so later copies are not scored again; the copies wait for the texts before them,
+    and after max_run copies in a row one is scored anyway, so the tweets waiting are bounded.
+    """
+    memo = OrderedDict()
+    # [key, result] in input order, result is None until the text is scored
+    pending = deque()
+    # the entries of the texts sent to score_distinct()
+    scoring = deque()
+    # key -> entry of the texts sent to score_distinct() and not scored yet, so their copies are not sent again
+    sent = {}
+
+    def to_score():
+        run = 0
+        for text in cleaned:
+            key = parse_cache.text_key(text)
+            stats.tweets += 1
+            if run < max_run and (key in memo or key in sent):
+                run += 1
+                if key in memo:
+                    memo.move_to_end(key)
+                    pending.append([key, memo[key]])
+                else:
+                    pending.append(sent[key])
+                continue
+            run = 0
+            stats.scored += 1
+            entry = sent[key] = [key, None]
+            pending.append(entry)
+            scoring.append(entry)
+            yield text
+
+    for result in score_distinct(to_score()):
+        entry = scoring.popleft()
+        entry[1] = result
+        if sent.get(entry[0]) is entry:
+            del sent[entry[0]]
+        memo[entry[0]] = result
+        memo.move_to_end(entry[0])
+        while len(memo) > memo_size:
+            memo.popitem(last=False)
+        while pending and pending[0][1] is not None:
+            yield dict(pending.popleft()[1])
+    for key, result in pending:
+        yield dict(result)
+
+
+def score_csv(path_csv, explain, output=RESULTS_PATH, chunksize=CHUNK_SIZE, batch_size=BATCH_SIZE, n_process=1,
+              throughput=False, flush_every=FLUSH_EVERY, workers=1, shard_size=SHARD_SIZE, cache=None, dedup=False,
+              vectorized=False, matcher=False, scores=None, user=None):
+    """
+    Streaming pipeline: chunked csv read -> clean -> batched parse -> rules -> incremental csv write.
+    Memory doesn't grow with the size of the input. Without output the results are not written.
+    With workers > 1 parsing and rules run in a process pool (see iter_rules_parallel()).
+    With dedup identical cleaned tweets are parsed and scored once (see iter_dedup()).
+    With vectorized the rules are evaluated in batch mode (see iter_rules()).
+    With matcher the pattern rules are matched by the spaCy Matcher (see iter_postag()).
+    With a profiling.Profiler in profiler the time of each stage and of each rule is recorded; the time
+    spent waiting for the workers is the 'workers' stage.
+    With a utils.UserScores in scores the scores of the tweets are added to the ones of user.
+    """
+    tweets = profiled('reading', read_tweets(path_csv, chunksize))
+    start = time.perf_counter()
+    with worker_pool(workers) if workers > 1 else contextlib.nullcontext() as pool:
+        if dedup:
+            def score_distinct(texts):
+                if pool is not None:
+                    return profiled('workers', iter_rules_parallel(texts, explain, pool, workers, shard_size,
+                                                                   batch_size, cache, True, vectorized, matcher))
+                return iter_rules(iter_parse(texts, batch_size, n_process, False, cache, matcher), explain,
+                                  vectorized)
+
+            stats = DedupStats()
+            results = profiled('dedup', iter_dedup(profiled('cleaning', (utils.clean_tweet(t) for t in tweets)),
+                                                   score_distinct, stats))
+        elif pool is not None:
+            results = profiled('workers', iter_rules_parallel(tweets, explain, pool, workers, shard_size, batch_size,
+                                                              cache, vectorized=vectorized, matcher=matcher))
+        else:
+            results = iter_rules(iter_postag(tweets, batch_size, n_process, throughput, cache, matcher), explain,
+                                 vectorized)
+        if scores is not None:
+            results = scores.feed(user, results)
+        if output is not None:
+            n_results = write_results(results, output, flush_every)
+        else:
+            n_results = sum(1 for _ in results)
+    if dedup:
+        stats.report()
+    if throughput and (dedup or pool is not None):
+        report_throughput(n_results, time.perf_counter() - start, 'Scored')
+        if cache is not None:
+            report_cache(cache)
+    return n_results
 
 
 if __name__ == "__main__":
 
-    nlp = spacy.load("it_core_news_lg")
-    crafts_path = '../../script/inclusivity_management/docs/list.tsv'
-    crafts = utils.read_tsv(crafts_path)
-    male_list = list(crafts['itemLabel'])
-    female_list = list(crafts['femaleLabel'])
-    male_crafts = set(crafts['itemLabel'].unique())
-    female_crafts = set(crafts['femaleLabel'].unique())
-
     parser = argparse.ArgumentParser(description='Inclusivity rate calculator')
 
-    parser.add_argument('--userid', type=str, help="This parameter should be a Twitter user id, "
-                                                   "the inclusion rate is calculated on the last tweets of "
+    parser.add_argument('--userid', type=str, help="This parameter should be a Twitter user id, or more separated by "
+                                                   "commas, the inclusion rate is calculated on the last tweets of "
                                                    "the indicated user")
     parser.add_argument('--path', type=str, help="This parameter should be a path to the csv with a list of tweet")
     parser.add_argument('--n_tweet', type=int, help="This parameter should be the number of the tweet to retrieve")
@@ -434,38 +1005,128 @@ if __name__ == "__main__":
                         help="This parameter don't return the explaination of the score")
     parser.set_defaults(explain=True)
     parser.add_argument('--verbose', dest='verbose', action='store_true')
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE,
+                        help="This parameter should be the number of tweets parsed together by spaCy")
+    parser.add_argument('--n_process', type=int, default=1,
+                        help="This parameter should be the number of processes used by spaCy to parse the tweets")
+    parser.add_argument('--throughput', dest='throughput', action='store_true',
+                        help="This parameter prints the number of tweets parsed per second")
+    parser.set_defaults(throughput=False)
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE,
+                        help="This parameter should be the number of rows of the csv read at a time")
+    parser.add_argument('--flush_every', type=int, default=FLUSH_EVERY,
+                        help="This parameter should be the number of results written between two flushes of the output")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="This parameter should be the number of worker processes that score the tweets")
+    parser.add_argument('--shard_size', type=int, default=SHARD_SIZE,
+                        help="This parameter should be the number of tweets scored by a worker at a time")
+    parser.add_argument('--parse_cache', type=str,
+                        help="This parameter should be a directory where the parses of the tweets are cached")
+    parser.add_argument('--dedup', dest='dedup', action='store_true',
+                        help="This parameter parses and scores only once the tweets that are identical after cleaning")
+    parser.set_defaults(dedup=False)
+    parser.add_argument('--vectorized', dest='vectorized', action='store_true',
+                        help="This parameter evaluates the rules on batches of tweets with NumPy")
+    parser.set_defaults(vectorized=False)
+    parser.add_argument('--matcher', dest='matcher', action='store_true',
+                        help="This parameter matches the pattern rules with the spaCy Matcher during parsing")
+    parser.set_defaults(matcher=False)
+    parser.add_argument('--profile', type=str, nargs='?', const=PROFILE_PATH,
+                        help="This parameter records the time, calls and fires of each rule and stage, and saves "
+                             "them as JSON to the given path (default " + PROFILE_PATH + ")")
+    parser.add_argument('--prefilter', dest='prefilter', action='store_true',
+                        help="This parameter doesn't parse the tweets that no rule can score, checking their words")
+    parser.set_defaults(prefilter=False)
+    parser.add_argument('--prefilter_validate', dest='prefilter_validate', action='store_true',
+                        help="This parameter parses every tweet anyway and counts the tweets the prefilter would "
+                             "skip that score")
+    parser.set_defaults(prefilter_validate=False)
+    parser.add_argument('--rules', type=str,
+                        help="This parameter should be a path to a YAML or JSON spec of the rules "
+                             "(e.g. docs/rules.yaml), reloaded when it changes")
+    parser.add_argument('--model', type=str, default=MODEL_NAME,
+                        help="This parameter should be the spaCy model: a tier (sm, md, lg), the name of a package "
+                             "or the path of a model; sm has no word vectors and uses the least memory")
+    parser.add_argument('--output', type=str, default=RESULTS_PATH,
+                        help="This parameter should be the path of the csv of the results, with more users the id of "
+                             "the user is added to the name of the file")
+    parser.add_argument('--no_output', dest='output', action='store_const', const=None,
+                        help="This parameter doesn't write the results to a csv")
     parser.set_defaults(explain=True)
     parser.set_defaults(verbose=False)
     args = parser.parse_args()
+    if args.userid is None and args.path is None:
+        parser.error("one of --userid and --path is required")
 
     userid = args.userid
     path_csv = args.path
     n_tweet = args.n_tweet
     explain = args.explain
     verbose = args.verbose
+    batch_size = args.batch_size
+    n_process = args.n_process
+    throughput = args.throughput
+    chunksize = args.chunksize
+    flush_every = args.flush_every
+    workers = args.workers
+    shard_size = args.shard_size
+    dedup = args.dedup
+    vectorized = args.vectorized
+    matcher = args.matcher
+    nlp_model = args.model
+    nlp = load_model(nlp_model)
+    lexicons.get()
+    if args.rules is not None:
+        load_rules(args.rules)
+    if args.profile is not None:
+        profiler = profiling.Profiler()
+    if args.prefilter or args.prefilter_validate:
+        if args.rules is not None:
+            print("The prefilter knows only the rules of Rules.py: --prefilter is ignored with --rules")
+        else:
+            prefilter = lexical_prefilter.Prefilter(args.prefilter_validate)
+    cache = None
+    if args.parse_cache is not None:
+        cache = parse_cache.ParseCache(args.parse_cache, parse_cache.model_id(nlp))
 
     if verbose:
         logging.basicConfig(filename="../../log.txt", level=logging.INFO)
 
     if userid is not None:
-        with open("../../script/search_tweets/search_tweets.config", "r") as params_file:
-            params = yaml.safe_load(params_file)
-        params['twitter']['search']['user'] = userid
-        params['twitter']['search']['n_results'] = n_tweet
-
-        with open("../../script/search_tweets/search_tweets.config", "w") as params_file:
-            yaml.dump(params, params_file, default_flow_style=False)
-
-        search_tweets.main()
-        tweets = pd.read_csv('../../input.csv')
-        sentences, ph = save_postag(tweets)
-        d = rules(sentences, ph, explain)
-
-        inclusivity_score, user_label = utils.calculate_user_score('../../results.csv')
-        print("User '" + str(userid) + "' is classified as: " + str(user_label) + " with a score of: " + str(
-            inclusivity_score))
+        import yaml
+
+        sys.path.append('../search_tweets')
+        import search_tweets
+
+        users = [user for user in userid.split(',') if user]
+        scores = utils.UserScores()
+        for user in users:
+            with open("../../script/search_tweets/search_tweets.config", "r") as params_file:
+                params = yaml.safe_load(params_file)
+            params['twitter']['search']['user'] = user
+            params['twitter']['search']['n_results'] = n_tweet
+
+            with open("../../script/search_tweets/search_tweets.config", "w") as params_file:
+                yaml.dump(params, params_file, default_flow_style=False)
+
+            search_tweets.main()
+            output = args.output
+            if output is not None and len(users) > 1:
+                root, extension = os.path.splitext(output)
+                output = root + '_' + user + extension
+            score_csv('../../input.csv', explain, output, chunksize, batch_size, n_process, throughput, flush_every,
+                      workers, shard_size, cache, dedup, vectorized, matcher, scores, user)
+
+            inclusivity_score, user_label = scores.user_score(user)
+            print("User '" + str(user) + "' is classified as: " + str(user_label) + " with a score of: " + str(
+                inclusivity_score))
+            logging.info("User '%s': %d tweets, scores %s", user, scores.count(user), scores.histogram(user))
 
     if path_csv is not None:
-        tweets = pd.read_csv(path_csv)
-        sentences, ph = save_postag(tweets)
-        d = rules(sentences, ph, explain)
+        score_csv(path_csv, explain, args.output, chunksize, batch_size, n_process, throughput, flush_every,
+                  workers, shard_size, cache, dedup, vectorized, matcher)
+
+    if prefilter is not None:
+        prefilter.report()
+    if profiler is not None:
+        report_profile(args.profile)
@@ -0,0 +1,75 @@
+from collections import deque
+
+"""
+aho_corasick.py:
+This module contains a small Aho-Corasick automaton, used to search all the expressions of a lexicon
+in a text with a single pass over its characters, whatever the number of expressions.
+The automaton is built once from the lexicon and is read-only afterwards, so it can be shared.
+"""
+
+
+class AhoCorasick:
+
+    __slots__ = ('patterns', '_goto', '_fail', '_out')
+
+    def __init__(self, patterns):
+        """
+        Builds the automaton of the given patterns.
+
+        :param patterns: the strings to search
+        :type patterns: iterable of str
+        """
+        self.patterns = tuple(sorted(set(patterns)))
+        self._goto = [{}]
+        self._out = [[]]
+        for pattern in self.patterns:
+            state = 0
+            for char in pattern:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(pattern)
+
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+        self._out = [tuple(out) for out in self._out]
+
+    def iter(self, text):
+        """
+        Yields (end, pattern) for every occurrence of a pattern in text, where end is the index
+        after the last character of the occurrence.
+        """
+        for pattern in self._out[0]:
+            yield 0, pattern
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern in out[state]:
+                yield i + 1, pattern
+
+    def findall(self, text):
+        """
+        Returns the patterns found in text, once each, in the order in which they end.
+        """
+        found = {}
+        for end, pattern in self.iter(text):
+            found.setdefault(pattern, end)
+        return list(found)
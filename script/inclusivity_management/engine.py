@@ -0,0 +1,122 @@
+import token_array
+
+"""
+engine.py:
+This module contains the fused rule engine used by Rules.py: instead of running every rule as a separate walk
+over the tokens of a tweet, the tweet is walked once and each token is given only to the rules that can fire
+on its POS tag. Adding a rule doesn't add a walk over the tweet.
+There are two kinds of rules:
+- TokenRule:    a pattern anchored on a token. match(tweet, idx) tells if the pattern matches at idx;
+                the rule fires (adding its score once) if it matches on at least one token.
+- TweetRule:    a rule that needs the whole tweet (or the cleaned sentence), evaluated once per tweet.
+A tweet is a token_array.TokenArray, as built by Rules.save_postag().
+"""
+
+
+class TokenRule:
+
+    __slots__ = ('name', 'match', 'score', 'explanation', 'tags', 'vector', 'patterns')
+
+    def __init__(self, name, match, score, explanation, tags=None, vector=None, patterns=None):
+        """
+        :param name: the name of the rule
+        :type name: str
+        :param match: function (tweet, idx) -> bool, True if the pattern matches at token idx
+        :type match: callable
+        :param score: the score added to the inclusivity when the rule fires
+        :type score: float
+        :param explanation: the explanation of the score
+        :type explanation: str
+        :param tags: the POS tags of the tokens where the pattern can match, None for any tag
+        :type tags: iterable of str, optional
+        :param vector: function (batch) -> mask of the tokens of a vector_engine.TokenBatch where the pattern
+                       matches, used by the batch mode
+        :type vector: callable, optional
+        :param patterns: the spaCy Matcher patterns of the rule, used by matcher_engine.MatcherEngine
+        :type patterns: list, optional
+        """
+        self.name = name
+        self.match = match
+        self.score = score
+        self.explanation = explanation
+        self.tags = frozenset(token_array.pos_id(tag) for tag in tags) if tags is not None else None
+        self.vector = vector
+        self.patterns = patterns
+
+    def evaluate(self, sentence, tweet, explain):
+        """
+        Evaluates only this rule on the tweet, returning (score, explanation).
+        """
+        for idx in range(len(tweet)):
+            if (self.tags is None or tweet.pos[idx] in self.tags) and self.match(tweet, idx):
+                return self.score, self.explanation if explain else None
+        return 0.0, None
+
+
+class TweetRule:
+
+    __slots__ = ('name', 'evaluate', 'vector')
+
+    def __init__(self, name, evaluate, vector=None):
+        """
+        :param name: the name of the rule
+        :type name: str
+        :param evaluate: function (sentence, tweet, explain) -> (score, explanation)
+        :type evaluate: callable
+        :param vector: function (batch) -> mask of the tokens of a vector_engine.TokenBatch the rule needs to fire,
+                       used by the batch mode to skip the other tweets
+        :type vector: callable, optional
+        """
+        self.name = name
+        self.evaluate = evaluate
+        self.vector = vector
+
+
+class FusedEngine:
+
+    def __init__(self, rules):
+        """
+        Builds the dispatch table of the rules: POS tag id -> rules that can match on a token with that tag.
+
+        :param rules: the rules, in the order of their scores and explanations
+        :type rules: iterable of TokenRule and TweetRule
+        """
+        self.rules = tuple(rules)
+        self.names = tuple(rule.name for rule in self.rules)
+        token_rules = [(pos, rule) for pos, rule in enumerate(self.rules) if isinstance(rule, TokenRule)]
+        self._tweet_rules = tuple((pos, rule) for pos, rule in enumerate(self.rules) if isinstance(rule, TweetRule))
+        self._n_token_rules = len(token_rules)
+        self._any = tuple((pos, rule.match) for pos, rule in token_rules if rule.tags is None)
+        tags = set()
+        for pos, rule in token_rules:
+            if rule.tags is not None:
+                tags |= rule.tags
+        self._dispatch = {}
+        for tag in tags:
+            self._dispatch[tag] = tuple((pos, rule.match) for pos, rule in token_rules
+                                        if rule.tags is None or tag in rule.tags)
+
+    def evaluate(self, sentence, tweet, explain):
+        """
+        Evaluates all the rules with a single walk over the tweet.
+
+        :return: the list of (score, explanation) of every rule, in the order of the rules
+        :rtype: list
+        """
+        results = [(0.0, None)] * len(self.rules)
+        fired = set()
+        dispatch = self._dispatch
+        default = self._any
+        tags = tweet.pos
+        for idx in range(len(tweet)):
+            for pos, match in dispatch.get(tags[idx], default):
+                if pos not in fired and match(tweet, idx):
+                    fired.add(pos)
+            if len(fired) == self._n_token_rules:
+                break
+        for pos in fired:
+            rule = self.rules[pos]
+            results[pos] = (rule.score, rule.explanation if explain else None)
+        for pos, rule in self._tweet_rules:
+            results[pos] = rule.evaluate(sentence, tweet, explain)
+        return results
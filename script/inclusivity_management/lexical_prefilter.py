@@ -0,0 +1,166 @@
+import logging
+import re
+
+import lexicons
+from lexicons import FEMALE_NAME, SURNAME
+
+"""
+lexical_prefilter.py:
+This module contains the lexical prefilter of Rules.py: a check on the cleaned text of a tweet, without parsing it,
+that no rule of Rules.RULES can fire on it. Every rule needs at least one trigger in the text:
+- words_ends_with2gender(), pronoun_inclusive(), article_inclusive():   a '/' or '\\' token.
+- schwa():                                                              a token ending with '*' or 'ə'.
+- article_noun():                                                       a female name or a surname right after
+                                                                        a feminine article.
+- femaleName_maleAppos(), nome_predicato_maschile(), art_donna_noun(),
+  maleAppos_femaleName(), noun_donna():                                 a male craft (the name and 'donna' rules
+                                                                        need one too).
+- male_collettives():                                                   a noun whose lemma is a male craft: a word
+                                                                        starting with the stem of a craft
+                                                                        (e.g. "avvocat" for "avvocati").
+- femaleSub_malePart():                                                 an auxiliary with a gender, that is a
+                                                                        singular participle (e.g. "stato").
+- male_expressions():                                                   one of the expressions of uomini_di.txt.
+The tokens of spaCy are looked for among the words of the text (the runs of \\w and of letters); the lexicon
+forms that are not a single word (e.g. "d'alema") are looked for as substrings.
+The tweets without triggers are not parsed: they get an empty token_array.TokenArray, on which every rule
+scores 0.0 with no explanation, as on their parse.
+The check is not exact where the rules depend on the model: femaleSub_malePart() and article_noun() on a word the
+model tags as auxiliary or as feminine article without being one, and male_collettives() on the lemmatizer, since
+the stem of a craft is only a heuristic for the lemmas the model gives (a lemma that is a craft of a word that
+doesn't start with its stem is missed). --prefilter_validate is the safety net: every tweet is parsed anyway, and
+the tweets that the prefilter would have skipped but that score are counted and logged.
+"""
+
+# singular participles of the auxiliary and modal verbs: femaleSub_malePart() needs an auxiliary with Gender and
+# VerbForm, and the finite forms (è, ha, può, ...) have no gender
+AUXILIARIES = frozenset([
+    'stato', 'stata', 'avuto', 'avuta', 'venuto', 'venuta', 'andato', 'andata',
+    'potuto', 'potuta', 'dovuto', 'dovuta', 'voluto', 'voluta',
+])
+# feminine articles and articulated prepositions, as words: "l'" and "un'" are the words "l" and "un"
+FEMININE_ARTICLES = frozenset([
+    'la', 'le', 'una', 'l', 'un',
+    'della', 'delle', 'dell', 'dalla', 'dalle', 'dall', 'nella', 'nelle', 'nell',
+    'alla', 'alle', 'all', 'sulla', 'sulle', 'sull', 'colla', 'colle', 'pella', 'pelle',
+])
+# characters of the tokens of the inclusive forms
+TRIGGER_CHARS = ('/', '\\', '*', 'ə')
+# the lexicon classes of the tokens after a feminine article
+NAME_CLASSES = FEMALE_NAME | SURNAME
+# the shortest stem of a craft, the labels with a shorter one (e.g. "re") have to match whole
+MIN_STEM = 3
+
+WORD = re.compile(r"\w+")
+LETTERS = re.compile(r"[^\W\d_]+")
+
+
+class Prefilter:
+
+    def __init__(self, validate=False):
+        """
+        Builds the triggers from the lexicons.
+
+        :param validate: whether the tweets are parsed anyway, to check the prefilter (see Rules.iter_parse())
+        :type validate: bool
+        """
+        lex = lexicons.get()
+        self.classes = lex.classes
+        self.validate = validate
+        self.expressions = re.compile('|'.join(re.escape(expression)
+                                               for expression in lex.male_expressions_matcher.patterns))
+        # forms that are not a single word, by their first word
+        self.compound = {}
+        for lexicon in (lex.female_names, lex.surnames):
+            for form in lexicon:
+                self._add_compound(form.lower())
+        # the plurals of the crafts differ from the singular in the last vowel (avvocato/avvocati, medico/medici)
+        stems = set()
+        crafts = set()
+        for label in lex.male_list:
+            if not label:
+                continue
+            label = label.lower()
+            if not WORD.fullmatch(label):
+                self._add_compound(label)
+            elif len(label) - 1 < MIN_STEM:
+                crafts.add(label)
+            else:
+                stems.add(label[:-1])
+        self.crafts = frozenset(crafts)
+        self.stems = frozenset(stems)
+        self.stem_lengths = sorted(set(len(stem) for stem in stems))
+        # tweets checked, tweets without triggers and, in validate mode, tweets without triggers that scored
+        self.tweets = 0
+        self.bypassed = 0
+        self.violations = 0
+
+    def _add_compound(self, form):
+        if form and not WORD.fullmatch(form):
+            first = WORD.search(form)
+            self.compound.setdefault(first.group() if first else '', []).append(form)
+
+    def _word_triggers(self, word):
+        if word in AUXILIARIES or word in self.crafts:
+            return True
+        stems = self.stems
+        for length in self.stem_lengths:
+            if length > len(word):
+                break
+            if word[:length] in stems:
+                return True
+        return False
+
+    def may_score(self, text):
+        """
+        Returns False if no rule can fire on the cleaned text.
+        """
+        text = text.lower()
+        for char in TRIGGER_CHARS:
+            if char in text:
+                return True
+        if self.expressions.search(text) is not None:
+            return True
+        words = []
+        for word in WORD.findall(text):
+            words.append(word)
+            if not word.isalpha():
+                words.extend(LETTERS.findall(word))
+        classes = self.classes
+        previous = None
+        for word in words:
+            if previous in FEMININE_ARTICLES and classes.get(word, 0) & NAME_CLASSES:
+                return True
+            previous = word
+        compound = self.compound
+        for form in compound.get('', ()):
+            if form in text:
+                return True
+        for word in set(words):
+            if self._word_triggers(word):
+                return True
+            for form in compound.get(word, ()):
+                if form in text:
+                    return True
+        return False
+
+    def take(self):
+        # the counters since the last take(), as sent back by the worker processes
+        counts = (self.tweets, self.bypassed, self.violations)
+        self.tweets = self.bypassed = self.violations = 0
+        return counts
+
+    def merge(self, counts):
+        tweets, bypassed, violations = counts
+        self.tweets += tweets
+        self.bypassed += bypassed
+        self.violations += violations
+
+    def report(self):
+        if self.validate:
+            message = "Prefilter: {} of {} tweets without triggers, {} of them scored when parsed".format(
+                self.bypassed, self.tweets, self.violations)
+        else:
+            message = "Prefilter: {} of {} tweets not parsed".format(self.bypassed, self.tweets)
+        logging.info(message)
+        print(message)
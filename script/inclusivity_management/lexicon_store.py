@@ -0,0 +1,425 @@
+import argparse
+import array
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+"""
+lexicon_store.py:
+This module compiles all the lexicons in docs/ into a single versioned binary file, docs/lexicons.bin,
+that is opened with mmap: loading it costs almost nothing and its pages are shared by every process
+that opens the same file, instead of each process building its own Python sets.
+The file starts with a header and the list of the source files (size, mtime and sha256), so a change
+in docs/ makes the artifact stale and it is compiled again.
+Each lexicon is stored in a section as an array of offsets into a blob of utf-8 strings:
+- SORTED sections keep the strings sorted by their bytes and are searched with a binary search.
+- ROWS sections keep the strings in the original order of the file (e.g. the columns of list.tsv),
+  an empty string marks a missing value.
+- CLASSES sections are SORTED sections with a parallel array of uint32: the 'classes' section maps every
+  lowercased form of the lexicons to a bitmask of the lexicons it belongs to (see compile_classes()).
+  After the array there is an open addressing hash table (crc32 of the utf-8 form, linear probing) of the
+  positions of the forms + 1, so a form is looked up with a single probe instead of a binary search.
+Usage:
+    python lexicon_store.py             compiles docs/ into docs/lexicons.bin if it is stale
+    python lexicon_store.py --force     compiles it anyway
+"""
+
+MAGIC = b'RBIDLEX\0'
+FORMAT_VERSION = 3
+ARTIFACT_NAME = 'lexicons.bin'
+
+SORTED = 1
+ROWS = 2
+CLASSES = 3
+
+# forms whose classes are kept in memory by MappedClasses.get()
+CLASSES_MEMO_SIZE = 1 << 16
+
+# lexicon classes of a form; the craft pair ids are the row of list.tsv + 1, 0 when the form is not a craft
+FEMALE_NAME = 1 << 0
+MALE_NAME = 1 << 1
+SURNAME = 1 << 2
+MALE_CRAFT = 1 << 3
+FEMALE_CRAFT = 1 << 4
+CLASS_FLAGS = 0xFF
+PAIR_ID_BITS = 12
+MALE_PAIR_SHIFT = 8
+FEMALE_PAIR_SHIFT = MALE_PAIR_SHIFT + PAIR_ID_BITS
+PAIR_ID_MASK = (1 << PAIR_ID_BITS) - 1
+
+_HEADER = struct.Struct('<8sIIII')
+_SOURCE = struct.Struct('<32sQQ32s')
+_SECTION = struct.Struct('<32sIIQQQQ')
+_BYTEORDER = {'little': 1, 'big': 2}[sys.byteorder]
+
+# name of the section -> (source file, column of list.tsv or None, kind)
+SECTIONS = {
+    'female_names': ('nomif.txt', None, SORTED),
+    'male_names': ('nomim.txt', None, SORTED),
+    'surnames': ('lista_cognomi.txt', None, SORTED),
+    'male_expressions': ('uomini_di.txt', None, SORTED),
+    'male_list': ('list.tsv', 'itemLabel', ROWS),
+    'female_list': ('list.tsv', 'femaleLabel', ROWS),
+    'classes': (None, None, CLASSES),
+}
+
+
+def source_files():
+    return sorted(set(source for source, column, kind in SECTIONS.values() if source is not None))
+
+
+def _file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.digest()
+
+
+def _read_lines(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f]
+
+
+def read_tsv_column(path, column):
+    # same rows as pandas.read_csv(sep='\t'): blank lines are skipped, missing values are empty strings
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [line.rstrip('\r\n') for line in f]
+    idx = lines[0].split('\t').index(column)
+    values = []
+    for line in lines[1:]:
+        if line.strip() == '':
+            continue
+        fields = line.split('\t')
+        values.append(fields[idx] if idx < len(fields) else '')
+    return values
+
+
+def compile_classes(female_names, male_names, surnames, male_list, female_list):
+    """
+    Merges the lexicons into a single dict: lowercased form -> bitmask of FEMALE_NAME, MALE_NAME, SURNAME,
+    MALE_CRAFT and FEMALE_CRAFT, with the craft pair ids of the form as male and as female label.
+    The pair id of a label is its first row in list.tsv, as list.index() did.
+    """
+    if len(male_list) >= PAIR_ID_MASK:
+        raise ValueError("Too many crafts for {} bits pair ids".format(PAIR_ID_BITS))
+    classes = {}
+    for lexicon, flag in ((female_names, FEMALE_NAME), (male_names, MALE_NAME), (surnames, SURNAME)):
+        for form in lexicon:
+            form = form.lower()
+            classes[form] = classes.get(form, 0) | flag
+    for labels, flag, shift in ((male_list, MALE_CRAFT, MALE_PAIR_SHIFT),
+                                (female_list, FEMALE_CRAFT, FEMALE_PAIR_SHIFT)):
+        for row, form in enumerate(labels):
+            if not form:
+                continue
+            form = form.lower()
+            value = classes.get(form, 0)
+            if not value & flag:
+                value |= flag | ((row + 1) << shift)
+            classes[form] = value
+    return classes
+
+
+def male_pair_id(classes):
+    return (classes >> MALE_PAIR_SHIFT) & PAIR_ID_MASK
+
+
+def female_pair_id(classes):
+    return (classes >> FEMALE_PAIR_SHIFT) & PAIR_ID_MASK
+
+
+def hash_slots(count):
+    # the number of slots of the hash table of a CLASSES section: a power of 2, at most half full
+    slots = 1
+    while slots < 2 * count:
+        slots <<= 1
+    return slots
+
+
+def _hash_table(strings):
+    mask = hash_slots(len(strings)) - 1
+    table = array.array('I', [0]) * (mask + 1)
+    for position, s in enumerate(strings):
+        slot = zlib.crc32(s.encode('utf-8')) & mask
+        while table[slot]:
+            slot = (slot + 1) & mask
+        table[slot] = position + 1
+    return table.tobytes()
+
+
+def _pack_strings(strings):
+    blob = bytearray()
+    offsets = array.array('I', [0])
+    for s in strings:
+        blob += s.encode('utf-8')
+        offsets.append(len(blob))
+    return offsets.tobytes(), bytes(blob)
+
+
+def build(docs_dir, path=None):
+    if path is None:
+        path = os.path.join(docs_dir, ARTIFACT_NAME)
+    sources = []
+    for name in source_files():
+        file_path = os.path.join(docs_dir, name)
+        st = os.stat(file_path)
+        sources.append((name, st.st_size, st.st_mtime_ns, _file_digest(file_path)))
+
+    lists = {}
+    for name, (source, column, kind) in SECTIONS.items():
+        if source is None:
+            continue
+        file_path = os.path.join(docs_dir, source)
+        if column is None:
+            lists[name] = _read_lines(file_path)
+        else:
+            lists[name] = read_tsv_column(file_path, column)
+    classes = compile_classes(lists['female_names'], lists['male_names'], lists['surnames'],
+                              lists['male_list'], lists['female_list'])
+
+    sections = []
+    for name, (source, column, kind) in SECTIONS.items():
+        values = b''
+        if kind == CLASSES:
+            strings = sorted(classes, key=lambda s: s.encode('utf-8'))
+            values = array.array('I', (classes[s] for s in strings)).tobytes() + _hash_table(strings)
+        elif kind == SORTED:
+            strings = sorted(set(lists[name]), key=lambda s: s.encode('utf-8'))
+        else:
+            strings = lists[name]
+        offsets, blob = _pack_strings(strings)
+        sections.append((name, kind, len(strings), offsets, blob, values))
+
+    header_len = _HEADER.size + _SOURCE.size * len(sources) + _SECTION.size * len(sections)
+    table = []
+    body = bytearray()
+    for name, kind, count, offsets, blob, values in sections:
+        offsets_pos = header_len + len(body)
+        body += offsets
+        values_pos = header_len + len(body)
+        body += values
+        blob_pos = header_len + len(body)
+        body += blob
+        table.append(_SECTION.pack(name.encode('utf-8'), kind, count, offsets_pos, values_pos, blob_pos,
+                                   len(blob)))
+
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, _BYTEORDER, len(sources), len(sections)))
+        for name, size, mtime_ns, digest in sources:
+            f.write(_SOURCE.pack(name.encode('utf-8'), size, mtime_ns, digest))
+        for entry in table:
+            f.write(entry)
+        f.write(body)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _read_header(buf):
+    magic, version, byteorder, n_sources, n_sections = _HEADER.unpack_from(buf, 0)
+    if magic != MAGIC or version != FORMAT_VERSION or byteorder != _BYTEORDER:
+        return None
+    pos = _HEADER.size
+    sources = []
+    for _ in range(n_sources):
+        name, size, mtime_ns, digest = _SOURCE.unpack_from(buf, pos)
+        sources.append((name.rstrip(b'\0').decode('utf-8'), size, mtime_ns, digest))
+        pos += _SOURCE.size
+    sections = {}
+    for _ in range(n_sections):
+        name, kind, count, offsets_pos, values_pos, blob_pos, blob_len = _SECTION.unpack_from(buf, pos)
+        sections[name.rstrip(b'\0').decode('utf-8')] = (kind, count, offsets_pos, values_pos, blob_pos, blob_len)
+        pos += _SECTION.size
+    return sources, sections
+
+
+def is_fresh(docs_dir, path=None):
+    if path is None:
+        path = os.path.join(docs_dir, ARTIFACT_NAME)
+    try:
+        with open(path, 'rb') as f:
+            header = _read_header(f.read(_HEADER.size + _SOURCE.size * 16 + _SECTION.size * 16))
+    except (OSError, struct.error):
+        return False
+    if header is None:
+        return False
+    sources, sections = header
+    if [s[0] for s in sources] != source_files() or set(sections) != set(SECTIONS):
+        return False
+    for name, size, mtime_ns, digest in sources:
+        try:
+            st = os.stat(os.path.join(docs_dir, name))
+        except OSError:
+            return False
+        if st.st_size != size:
+            return False
+        # a different mtime alone does not invalidate the artifact if the content is the same
+        if st.st_mtime_ns != mtime_ns and _file_digest(os.path.join(docs_dir, name)) != digest:
+            return False
+    return True
+
+
+class MappedStrings:
+    """
+    Read-only view of a section of the artifact: strings are decoded only when they are requested.
+    Membership is a binary search for SORTED sections and a linear scan for ROWS sections.
+    """
+
+    __slots__ = ('_buf', '_offsets', '_blob_pos', '_count', '_sorted')
+
+    def __init__(self, buf, kind, count, offsets_pos, blob_pos):
+        self._buf = buf
+        self._offsets = memoryview(buf)[offsets_pos:offsets_pos + 4 * (count + 1)].cast('I')
+        self._blob_pos = blob_pos
+        self._count = count
+        self._sorted = kind != ROWS
+
+    def _item(self, i):
+        return self._buf[self._blob_pos + self._offsets[i]:self._blob_pos + self._offsets[i + 1]]
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self._item(i).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._item(i).decode('utf-8')
+
+    def find(self, token):
+        """
+        Returns the position of token in the section, -1 if it is missing.
+        """
+        if not isinstance(token, str):
+            return -1
+        key = token.encode('utf-8')
+        if not self._sorted:
+            for i in range(self._count):
+                if self._item(i) == key:
+                    return i
+            return -1
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            item = self._item(mid)
+            if item < key:
+                lo = mid + 1
+            elif item > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def __contains__(self, token):
+        return self.find(token) != -1
+
+
+class MappedClasses(MappedStrings):
+    """
+    Read-only view of a CLASSES section: get() returns the bitmask of a form, as dict.get() does,
+    probing the hash table of the section; the forms of the tweets repeat, so the results of the first
+    CLASSES_MEMO_SIZE forms looked up are kept in a dict.
+    """
+
+    __slots__ = ('_values', '_table', '_mask', '_memo')
+
+    def __init__(self, buf, kind, count, offsets_pos, values_pos, blob_pos):
+        super().__init__(buf, kind, count, offsets_pos, blob_pos)
+        self._values = memoryview(buf)[values_pos:values_pos + 4 * count].cast('I')
+        slots = hash_slots(count)
+        table_pos = values_pos + 4 * count
+        self._table = memoryview(buf)[table_pos:table_pos + 4 * slots].cast('I')
+        self._mask = slots - 1
+        # the forms already looked up by this process -> their bitmask, -1 if missing
+        self._memo = {}
+
+    def find(self, token):
+        if not isinstance(token, str):
+            return -1
+        key = token.encode('utf-8')
+        table = self._table
+        mask = self._mask
+        slot = zlib.crc32(key) & mask
+        while True:
+            position = table[slot]
+            if not position:
+                return -1
+            if self._item(position - 1) == key:
+                return position - 1
+            slot = (slot + 1) & mask
+
+    def get(self, form, default=0):
+        value = self._memo.get(form)
+        if value is None:
+            i = self.find(form)
+            value = self._values[i] if i != -1 else -1
+            if len(self._memo) < CLASSES_MEMO_SIZE:
+                self._memo[form] = value
+        return value if value != -1 else default
+
+
+class LexiconStore:
+    """
+    The artifact opened with mmap. Every section of SECTIONS is available as a MappedStrings attribute
+    (MappedClasses for the 'classes' section).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = _read_header(self._mmap)
+        if header is None:
+            self._mmap.close()
+            raise ValueError("'{}' is not a lexicon artifact of version {}".format(path, FORMAT_VERSION))
+        self.sources, sections = header
+        for name, (kind, count, offsets_pos, values_pos, blob_pos, blob_len) in sections.items():
+            if kind == CLASSES:
+                section = MappedClasses(self._mmap, kind, count, offsets_pos, values_pos, blob_pos)
+            else:
+                section = MappedStrings(self._mmap, kind, count, offsets_pos, blob_pos)
+            setattr(self, name, section)
+
+
+def open_store(docs_dir, path=None, rebuild=True):
+    """
+    Returns the LexiconStore of docs_dir, compiling it again when it is missing or stale.
+    Returns None if the artifact is stale and can't be written (e.g. read-only installation).
+    """
+    if path is None:
+        path = os.path.join(docs_dir, ARTIFACT_NAME)
+    if not is_fresh(docs_dir, path):
+        if not rebuild:
+            return None
+        try:
+            build(docs_dir, path)
+        except OSError:
+            return None
+    return LexiconStore(path)
+
+
+if __name__ == "__main__":
+    import lexicons
+
+    parser = argparse.ArgumentParser(description='Compile the lexicons in docs/ into a binary artifact')
+    parser.add_argument('--docs', type=str, default=lexicons.DOCS_DIR, help="The directory with the lexicons")
+    parser.add_argument('--output', type=str, help="The path of the artifact, by default docs/lexicons.bin")
+    parser.add_argument('--force', dest='force', action='store_true',
+                        help="Compile the artifact even if it is up to date")
+    parser.set_defaults(force=False)
+    args = parser.parse_args()
+
+    output = args.output if args.output is not None else os.path.join(args.docs, ARTIFACT_NAME)
+    if args.force or not is_fresh(args.docs, output):
+        print("Compiled lexicons in: " + build(args.docs, output))
+    else:
+        print("Lexicons are up to date: " + output)
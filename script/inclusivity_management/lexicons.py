@@ -0,0 +1,116 @@
+import os
+import threading
+from collections import namedtuple
+
+import lexicon_store
+from aho_corasick import AhoCorasick
+from lexicon_store import FEMALE_NAME, MALE_NAME, SURNAME, MALE_CRAFT, FEMALE_CRAFT, male_pair_id, female_pair_id
+
+"""
+lexicons.py:
+This module keeps the lexicons stored in docs/ in memory, so that every rule of Rules.py can query them
+without reading the files again.
+Each list is loaded once per process into immutable structures and shared through get().
+The lists are read from the binary artifact compiled by lexicon_store.py, which is memory-mapped and
+compiled again when the files in docs/ change; if it can't be used the text files are read into frozensets.
+All the lexicons are also merged in the 'classes' table, that maps a lowercased form to the bitmask of
+the lexicons it belongs to (FEMALE_NAME, MALE_NAME, SURNAME, MALE_CRAFT, FEMALE_CRAFT) and to its craft
+pair ids, so a token is classified with a single lookup.
+The expressions of uomini_di.txt are compiled into an Aho-Corasick automaton ('male_expressions_matcher')
+that finds all of them with a single pass over a text.
+- get():        returns the loaded lexicons, loading them on the first call.
+- reload():     reads again the files in docs/ and replaces the shared lexicons, for example after a lexicon update.
+- classify():   returns the bitmask of the lexicon classes of a token.
+"""
+
+DOCS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'docs')
+
+FEMALE_NAMES_FILE = 'nomif.txt'
+MALE_NAMES_FILE = 'nomim.txt'
+SURNAMES_FILE = 'lista_cognomi.txt'
+MALE_EXPRESSIONS_FILE = 'uomini_di.txt'
+CRAFTS_FILE = 'list.tsv'
+
+Lexicons = namedtuple('Lexicons', ['female_names', 'male_names', 'surnames', 'male_expressions',
+                                   'male_list', 'female_list', 'male_crafts', 'female_crafts', 'classes',
+                                   'male_expressions_matcher'])
+
+_lexicons = None
+_lock = threading.Lock()
+
+
+def read_lexicon(file_name, docs_dir=DOCS_DIR):
+    with open(os.path.join(docs_dir, file_name), 'r', encoding='utf-8') as f:
+        return frozenset(line.strip() for line in f)
+
+
+def _craft_column(values):
+    # missing labels are None, as the NaN of the pandas reading of list.tsv
+    return tuple(value if value != '' else None for value in values)
+
+
+def _expressions_matcher(expressions):
+    # the expressions are searched in lowercased texts
+    return AhoCorasick(expression.lower() for expression in expressions)
+
+
+def read_crafts(docs_dir=DOCS_DIR):
+    path = os.path.join(docs_dir, CRAFTS_FILE)
+    return (_craft_column(lexicon_store.read_tsv_column(path, 'itemLabel')),
+            _craft_column(lexicon_store.read_tsv_column(path, 'femaleLabel')))
+
+
+def load(docs_dir=DOCS_DIR, use_store=True):
+    store = lexicon_store.open_store(docs_dir) if use_store else None
+    if store is not None:
+        male_list = _craft_column(store.male_list)
+        female_list = _craft_column(store.female_list)
+        male_expressions = frozenset(store.male_expressions)
+        return Lexicons(female_names=store.female_names,
+                        male_names=store.male_names,
+                        surnames=store.surnames,
+                        male_expressions=male_expressions,
+                        male_list=male_list,
+                        female_list=female_list,
+                        male_crafts=frozenset(male_list),
+                        female_crafts=frozenset(female_list),
+                        classes=store.classes,
+                        male_expressions_matcher=_expressions_matcher(male_expressions))
+
+    male_list, female_list = read_crafts(docs_dir)
+    female_names = read_lexicon(FEMALE_NAMES_FILE, docs_dir)
+    male_names = read_lexicon(MALE_NAMES_FILE, docs_dir)
+    surnames = read_lexicon(SURNAMES_FILE, docs_dir)
+    male_expressions = read_lexicon(MALE_EXPRESSIONS_FILE, docs_dir)
+    return Lexicons(female_names=female_names,
+                    male_names=male_names,
+                    surnames=surnames,
+                    male_expressions=male_expressions,
+                    male_list=male_list,
+                    female_list=female_list,
+                    male_crafts=frozenset(male_list),
+                    female_crafts=frozenset(female_list),
+                    classes=lexicon_store.compile_classes(female_names, male_names, surnames, male_list,
+                                                          female_list),
+                    male_expressions_matcher=_expressions_matcher(male_expressions))
+
+
+def get():
+    global _lexicons
+    if _lexicons is None:
+        with _lock:
+            if _lexicons is None:
+                _lexicons = load()
+    return _lexicons
+
+
+def reload():
+    global _lexicons
+    lexicons = load()
+    with _lock:
+        _lexicons = lexicons
+    return lexicons
+
+
+def classify(token):
+    return get().classes.get(str(token).lower(), 0)
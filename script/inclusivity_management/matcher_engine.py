@@ -0,0 +1,96 @@
+import threading
+
+import engine
+import lexicons
+from lexicons import FEMALE_NAME, MALE_NAME, SURNAME, MALE_CRAFT
+
+"""
+matcher_engine.py:
+This module contains the engine that runs the pattern rules with the spaCy Matcher: the patterns of all the
+rules are registered once in a Matcher, and each parsed doc is matched with a single call, while it goes
+through the nlp.pipe stream. The names of the matched rules are kept in the token_array.TokenArray of the
+tweet ('matches'), and evaluate() turns them into the scores and explanations of the rules.
+The patterns are given to engine.TokenRule ('patterns'), in the Matcher format; the lexicons are read by
+the patterns with the token extensions in EXTENSIONS, e.g. {"_": {"lex_female_name": True}}.
+The rules without patterns, the TweetRule ones and the tweets not matched (for example read from the
+parse cache, that has no docs) are evaluated as in engine.FusedEngine.
+"""
+
+# token extension -> lexicon class of lexicons.classify()
+EXTENSIONS = {
+    'lex_female_name': FEMALE_NAME,
+    'lex_male_name': MALE_NAME,
+    'lex_surname': SURNAME,
+    'lex_male_craft': MALE_CRAFT,
+}
+
+
+def _class_getter(flag):
+    def getter(token):
+        return lexicons.classify(token.text) & flag != 0
+    return getter
+
+
+def register_extensions():
+    from spacy.tokens import Token
+    for name, flag in EXTENSIONS.items():
+        if not Token.has_extension(name):
+            Token.set_extension(name, getter=_class_getter(flag))
+
+
+class MatcherEngine:
+
+    def __init__(self, rules):
+        """
+        The Matcher is built on the vocab of the first doc matched, see matches().
+
+        :param rules: the rules, in the order of their scores and explanations
+        :type rules: iterable of engine.TokenRule and engine.TweetRule
+        """
+        self.rules = tuple(rules)
+        self.names = tuple(rule.name for rule in self.rules)
+        self._fused = engine.FusedEngine(self.rules)
+        self._matcher = None
+        self._vocab = None
+        self._lock = threading.Lock()
+
+    def _get_matcher(self, vocab):
+        if self._matcher is None or self._vocab is not vocab:
+            with self._lock:
+                if self._matcher is None or self._vocab is not vocab:
+                    from spacy.matcher import Matcher
+                    register_extensions()
+                    matcher = Matcher(vocab)
+                    for rule in self.rules:
+                        if isinstance(rule, engine.TokenRule) and rule.patterns is not None:
+                            matcher.add(rule.name, rule.patterns)
+                    self._matcher = matcher
+                    self._vocab = vocab
+        return self._matcher
+
+    def matches(self, doc):
+        """
+        Returns the names of the rules whose patterns match on the doc.
+        """
+        strings = doc.vocab.strings
+        return frozenset(strings[match_id] for match_id, start, end in self._get_matcher(doc.vocab)(doc))
+
+    def evaluate(self, sentence, tweet, explain):
+        """
+        Evaluates all the rules on a tweet, using its matches.
+
+        :return: the list of (score, explanation) of every rule, in the order of the rules
+        :rtype: list
+        """
+        matches = tweet.matches
+        if matches is None:
+            return self._fused.evaluate(sentence, tweet, explain)
+        results = []
+        for rule in self.rules:
+            if isinstance(rule, engine.TweetRule) or rule.patterns is None:
+                results.append(rule.evaluate(sentence, tweet, explain))
+            elif rule.name in matches:
+                results.append((rule.score, rule.explanation if explain else None))
+            else:
+                results.append((0.0, None))
+        return results
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import sqlite3
+from collections import deque
+
+"""
+parse_cache.py:
+This module contains an on-disk cache of the spaCy parses of the cleaned tweets, so that re-scoring the same
+tweets after a change of the rules or of the lexicons doesn't need the parser again.
+The cache is a SQLite database that maps the sha1 of the cleaned text (the output of utils.clean_tweet) to its
+tokens, stored as a compact JSON list of [text, pos, dep, morph features, lemma].
+Only the parser output is stored: the lexicon classes of the tokens are computed again when they are read.
+There is a database for every model name and version, so a different model never reads parses of another one.
+The tweets not in the cache go through a single nlp.pipe over the whole stream, so with n_process > 1 the
+processes of spaCy are started once per run.
+"""
+
+CACHE_FORMAT = 1
+# tweets found in the cache in a row after which an empty text is sent to nlp.pipe, see ParseCache.parse()
+MAX_RUN = 16
+
+
+def doc_tokens(doc):
+    """
+    Returns the tokens of a parsed doc as stored in the cache: [text, pos, dep, morph features, lemma],
+    with the morph features joined by '|'.
+    """
+    return [[token.text, token.pos_, token.dep_, '|'.join(token.morph), token.lemma_] for token in doc]
+
+
+def text_key(text):
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+def _batches(texts, batch_size):
+    batch = []
+    for text in texts:
+        batch.append(text)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def model_id(nlp):
+    meta = nlp.meta
+    return '{}_{}-{}'.format(meta.get('lang', ''), meta.get('name', ''), meta.get('version', ''))
+
+
+class ParseCache:
+
+    def __init__(self, directory, model):
+        """
+        :param directory: the directory of the cache databases, created if missing
+        :type directory: str
+        :param model: the id of the model (see model_id()), the cache is invalidated when it changes
+        :type model: str
+        """
+        self.directory = directory
+        self.model = model
+        self.path = os.path.join(directory, 'parses-{}-v{}.sqlite'.format(model, CACHE_FORMAT))
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self):
+        # the connection is not shared with other processes, each one opens its own
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_pid'] = None
+        return state
+
+    def _db(self):
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS parses (key BLOB PRIMARY KEY, tokens TEXT NOT NULL)')
+            self._pid = os.getpid()
+        return self._connection
+
+    def take(self):
+        # the counters since the last take(), as sent back by the worker processes
+        counts = (self.hits, self.misses)
+        self.hits = self.misses = 0
+        return counts
+
+    def merge(self, counts):
+        hits, misses = counts
+        self.hits += hits
+        self.misses += misses
+
+    def get_many(self, keys):
+        found = {}
+        keys = list(set(keys))
+        db = self._db()
+        # sqlite limits the number of parameters of a query
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            query = 'SELECT key, tokens FROM parses WHERE key IN ({})'.format(','.join('?' * len(part)))
+            for key, tokens in db.execute(query, part):
+                found[key] = json.loads(tokens)
+        return found
+
+    def put_many(self, items):
+        db = self._db()
+        with db:
+            db.executemany('INSERT OR REPLACE INTO parses (key, tokens) VALUES (?, ?)',
+                           [(key, json.dumps(tokens, ensure_ascii=False, separators=(',', ':')))
+                            for key, tokens in items])
+
+    def parse(self, nlp, texts, batch_size, n_process=1, max_run=MAX_RUN):
+        """
+        Yields (text, tokens, doc) for each text in input order: the texts in the cache are not parsed and have
+        no doc, the other ones are parsed with a single nlp.pipe and added to the cache.
+        The texts are looked up batch_size at a time and wait in a queue for the parses of the texts before
+        them. nlp.pipe yields a doc only after it has read a batch of texts, so after max_run texts found in
+        the cache in a row an empty text is sent to it, and the texts waiting are bounded also when all of
+        them are in the cache. The copies of a text sent to nlp.pipe are not sent again.
+        """
+        # [text, key, tokens, doc] in input order, tokens is None until the text is parsed
+        pending = deque()
+        # the entries of the texts sent to nlp.pipe, None for the empty texts
+        parsing = deque()
+        # key -> entry of the texts sent to nlp.pipe and not yet in the cache when it was last looked up,
+        # so their copies are not sent again
+        sent = {}
+        # the keys added to the cache since it was last looked up
+        written = []
+
+        def to_parse():
+            run = 0
+            for batch in _batches(texts, batch_size):
+                keys = [text_key(text) for text in batch]
+                found = self.get_many(keys)
+                for key in written:
+                    del sent[key]
+                written.clear()
+                for text, key in zip(batch, keys):
+                    if key in found or key in sent:
+                        self.hits += 1
+                        pending.append([text, key, found[key], None] if key in found else sent[key])
+                        run += 1
+                        if run == max_run:
+                            run = 0
+                            parsing.append(None)
+                            yield ''
+                        continue
+                    self.misses += 1
+                    entry = sent[key] = [text, key, None, None]
+                    pending.append(entry)
+                    parsing.append(entry)
+                    run = 0
+                    yield text
+
+        parsed = []
+        for doc in nlp.pipe(to_parse(), batch_size=batch_size, n_process=n_process):
+            entry = parsing.popleft()
+            if entry is not None:
+                entry[2] = doc_tokens(doc)
+                entry[3] = doc
+                parsed.append((entry[1], entry[2]))
+                if len(parsed) == batch_size:
+                    self.put_many(parsed)
+                    written.extend(key for key, tokens in parsed)
+                    parsed = []
+            while pending and pending[0][2] is not None:
+                text, key, tokens, text_doc = pending.popleft()
+                yield text, tokens, text_doc
+        if parsed:
+            self.put_many(parsed)
+        while pending:
+            text, key, tokens, text_doc = pending.popleft()
+            yield text, tokens, text_doc
@@ -0,0 +1,127 @@
+import json
+import time
+from contextlib import contextmanager
+
+"""
+profiling.py:
+This module contains the profiler of the --profile mode of Rules.py, that records for each stage of the
+pipeline (reading, cleaning, parsing, rules, writing) and for each rule the wall time and the number of
+calls, and for each rule the number of times it fired (it returned a score different from 0).
+The stages are nested (e.g. parsing pulls the cleaned tweets), so the time of a stage is its own time,
+without the time of the stages it waits for.
+When the profiler is not used Rules.py doesn't call it at all, so it costs nothing.
+"""
+
+
+class Profiler:
+
+    def __init__(self):
+        # name -> [seconds, calls] of the stages, name -> [seconds, calls, fires] of the rules
+        self.stages = {}
+        self.rules = {}
+        self._stack = []
+
+    def _enter(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def _exit(self, stage, calls=1):
+        start, children = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        entry = self.stages.setdefault(stage, [0.0, 0])
+        entry[0] += elapsed - children
+        entry[1] += calls
+        if self._stack:
+            self._stack[-1][1] += elapsed
+
+    def iterate(self, stage, iterable):
+        """
+        Yields the items of iterable, adding to stage the time spent producing each of them.
+        """
+        iterator = iter(iterable)
+        while True:
+            self._enter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._exit(stage, 0)
+                return
+            except BaseException:
+                self._exit(stage, 0)
+                raise
+            self._exit(stage)
+            yield item
+
+    @contextmanager
+    def stage(self, stage):
+        self._enter()
+        try:
+            yield
+        finally:
+            self._exit(stage, 0)
+
+    def count(self, stage, calls):
+        self.stages.setdefault(stage, [0.0, 0])[1] += calls
+
+    def evaluate(self, rules, sentence, tweet, explain):
+        """
+        Evaluates the rules one at a time on a tweet, recording the time of each one,
+        and returns the list of their (score, explanation).
+        """
+        results = []
+        for rule in rules:
+            start = time.perf_counter()
+            result = rule.evaluate(sentence, tweet, explain)
+            elapsed = time.perf_counter() - start
+            entry = self.rules.get(rule.name)
+            if entry is None:
+                entry = self.rules[rule.name] = [0.0, 0, 0]
+            entry[0] += elapsed
+            entry[1] += 1
+            if result[0] != 0:
+                entry[2] += 1
+            results.append(result)
+        return results
+
+    def snapshot(self, reset=False):
+        # the counters, as sent back by the worker processes
+        snapshot = {'stages': {name: list(entry) for name, entry in self.stages.items()},
+                    'rules': {name: list(entry) for name, entry in self.rules.items()}}
+        if reset:
+            self.stages = {}
+            self.rules = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        for name, (seconds, calls) in snapshot['stages'].items():
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+        for name, (seconds, calls, fires) in snapshot['rules'].items():
+            entry = self.rules.setdefault(name, [0.0, 0, 0])
+            entry[0] += seconds
+            entry[1] += calls
+            entry[2] += fires
+
+    def report(self):
+        return {
+            'stages': [{'stage': name, 'seconds': seconds, 'calls': calls}
+                       for name, (seconds, calls) in self.stages.items()],
+            'rules': [{'rule': name, 'seconds': seconds, 'calls': calls, 'fires': fires,
+                       'us_per_call': seconds / calls * 1e6 if calls else 0.0}
+                      for name, (seconds, calls, fires) in self.rules.items()],
+        }
+
+    def table(self):
+        lines = ["{:<28} {:>10} {:>10}".format('stage', 'seconds', 'calls')]
+        for name, (seconds, calls) in self.stages.items():
+            lines.append("{:<28} {:>10.3f} {:>10}".format(name, seconds, calls))
+        lines.append('')
+        lines.append("{:<28} {:>10} {:>10} {:>10} {:>10}".format('rule', 'seconds', 'calls', 'fires', 'us/call'))
+        for name, (seconds, calls, fires) in sorted(self.rules.items(), key=lambda item: -item[1][0]):
+            lines.append("{:<28} {:>10.3f} {:>10} {:>10} {:>10.1f}".format(name, seconds, calls, fires,
+                                                                           seconds / calls * 1e6 if calls else 0.0))
+        return '\n'.join(lines)
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=2)
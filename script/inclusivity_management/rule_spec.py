@@ -0,0 +1,334 @@
+import logging
+import os
+import re
+import threading
+import time
+
+import engine
+import lexicons
+import matcher_engine
+import token_array
+from aho_corasick import AhoCorasick
+
+"""
+rule_spec.py:
+This module compiles a declarative specification of the rules (a YAML or JSON file, e.g. docs/rules.yaml)
+into the rules of engine.py, so a rule can be added or re-weighted without editing Rules.py.
+The spec has a list of rules, in the order of their scores and explanations; each rule is one of:
+- patterns:     token patterns in the format of the spaCy Matcher (ORTH, TEXT, LOWER, LEMMA, POS, DEP, MORPH
+                and the lexicon extensions of matcher_engine.EXTENSIONS, with the operators IN, NOT_IN, REGEX
+                and, for MORPH, IS_SUPERSET). The rule adds weight if one of the patterns matches.
+- expressions:  a list of expressions, or the name of a file of docs/ with one expression per line, searched
+                in the lowercased tweet with an Aho-Corasick automaton. The rule adds weight if one is found,
+                unless the tweet contains one of the strings of 'unless'.
+- builtin:      the name of a rule of Rules.py, for the rules that can't be expressed by patterns
+                (e.g. male_collettives); weight and explanation override the ones of a pattern rule.
+Each pattern is compiled once into a match function over token_array.TokenArray, with the predicates on
+the interned tags and morphological analyses memoized by id, a vector function for the batch mode and
+the Matcher patterns, so the compiled rules run on every engine.
+RuleFile keeps the rules of a spec file compiled and compiles them again when the file changes, so a
+long-running process picks up the new rules without reloading the model or the lexicons.
+"""
+
+SPEC_VERSION = 1
+# seconds between two checks of the modification time of a spec file
+CHECK_EVERY = 1.0
+
+TEXT_ATTRS = ('ORTH', 'TEXT', 'LOWER', 'LEMMA')
+LABEL_ATTRS = {'POS': token_array.POS, 'DEP': token_array.DEP, 'MORPH': token_array.MORPH}
+
+
+class RuleSet:
+
+    def __init__(self, rules):
+        """
+        The rules and the engines that evaluate them.
+
+        :param rules: the rules, in the order of their scores and explanations
+        :type rules: iterable of engine.TokenRule and engine.TweetRule
+        """
+        self.rules = tuple(rules)
+        self.engine = engine.FusedEngine(self.rules)
+        self.matcher_engine = matcher_engine.MatcherEngine(self.rules)
+        self._vector_engine = None
+
+    @property
+    def vector_engine(self):
+        # built on first use, so NumPy is imported only in batch mode
+        if self._vector_engine is None:
+            import vector_engine
+            self._vector_engine = vector_engine.VectorEngine(self.rules)
+        return self._vector_engine
+
+
+def _value_predicate(attr, condition):
+    if not isinstance(condition, dict):
+        return lambda value: value == condition
+    tests = []
+    for operator, argument in condition.items():
+        if operator == 'IN':
+            values = frozenset(argument)
+            tests.append(lambda value, values=values: value in values)
+        elif operator == 'NOT_IN':
+            values = frozenset(argument)
+            tests.append(lambda value, values=values: value not in values)
+        elif operator == 'REGEX':
+            regex = re.compile(argument)
+            tests.append(lambda value, regex=regex: regex.search(value) is not None)
+        elif operator == 'IS_SUPERSET' and attr == 'MORPH':
+            features = frozenset(argument)
+            tests.append(lambda value, features=features: features.issubset(value.split('|')))
+        else:
+            raise ValueError("unsupported operator {} for {}".format(operator, attr))
+    return lambda value: all(test(value) for test in tests)
+
+
+class _LabelPredicate:
+
+    __slots__ = ('labels', 'predicate', 'memo')
+
+    def __init__(self, labels, predicate):
+        # predicate on the interned labels (token_array.Interner), memoized by id
+        self.labels = labels
+        self.predicate = predicate
+        self.memo = {}
+
+    def __call__(self, value):
+        result = self.memo.get(value)
+        if result is None:
+            result = self.predicate(self.labels[value])
+            self.memo[value] = result
+        return result
+
+
+def _text_getter(tweet, attr):
+    if attr == 'LEMMA':
+        return tweet.lemma
+    return tweet.text
+
+
+def _compile_token(spec):
+    """
+    Returns (match, vector) of a token spec: match(tweet, idx) and vector(batch) -> mask of the tokens.
+    """
+    checks = []
+    vectors = []
+    for attr, condition in spec.items():
+        if attr == '_':
+            expected = []
+            for extension, value in condition.items():
+                if extension not in matcher_engine.EXTENSIONS or not isinstance(value, bool):
+                    raise ValueError("unsupported extension {}: {}".format(extension, value))
+                expected.append((matcher_engine.EXTENSIONS[extension], value))
+            for flag, value in expected:
+                checks.append(lambda tweet, idx, flag=flag, value=value: (tweet.classes[idx] & flag != 0) == value)
+                vectors.append(lambda batch, flag=flag, value=value: batch.has_class(flag) == value)
+        elif attr in TEXT_ATTRS:
+            predicate = _value_predicate(attr, condition)
+            if attr == 'LOWER':
+                predicate = (lambda test: lambda value: test(value.lower()))(predicate)
+            checks.append(lambda tweet, idx, attr=attr, predicate=predicate:
+                          predicate(_text_getter(tweet, attr)[idx]))
+            if attr == 'LEMMA':
+                vectors.append(lambda batch, predicate=predicate: batch.lemma_where(predicate))
+            else:
+                vectors.append(lambda batch, predicate=predicate: batch.text_where(predicate))
+        elif attr in LABEL_ATTRS:
+            field = attr.lower()
+            predicate = _LabelPredicate(LABEL_ATTRS[attr], _value_predicate(attr, condition))
+            checks.append(lambda tweet, idx, field=field, predicate=predicate: predicate(getattr(tweet, field)[idx]))
+            vectors.append(lambda batch, field=field, predicate=predicate: batch.label_where(field, predicate))
+        else:
+            raise ValueError("unsupported token attribute {}".format(attr))
+
+    def match(tweet, idx):
+        for check in checks:
+            if not check(tweet, idx):
+                return False
+        return True
+
+    def vector(batch):
+        mask = batch.valid(0)
+        for token_vector in vectors:
+            mask = mask & token_vector(batch)
+        return mask
+
+    return match, vector
+
+
+def _anchor_tags(patterns):
+    # POS tags of the first token of all the patterns, None if a pattern can start with any tag
+    tags = set()
+    for pattern in patterns:
+        pos = pattern[0].get('POS') if pattern else None
+        if isinstance(pos, str):
+            tags.add(pos)
+        elif isinstance(pos, dict) and list(pos) == ['IN']:
+            tags.update(pos['IN'])
+        else:
+            return None
+    return tags
+
+
+def compile_patterns(patterns):
+    """
+    Returns (match, vector) of a list of token patterns: they match at idx if one of them matches
+    on the tokens starting at idx.
+    """
+    compiled = []
+    for pattern in patterns:
+        if not pattern:
+            raise ValueError("empty pattern")
+        compiled.append([_compile_token(spec) for spec in pattern])
+
+    def match(tweet, idx):
+        for tokens in compiled:
+            if idx + len(tokens) <= len(tweet):
+                for offset, (token_match, token_vector) in enumerate(tokens):
+                    if not token_match(tweet, idx + offset):
+                        break
+                else:
+                    return True
+        return False
+
+    def vector(batch):
+        mask = None
+        for tokens in compiled:
+            pattern_mask = batch.valid(len(tokens) - 1)
+            for offset, (token_match, token_vector) in enumerate(tokens):
+                pattern_mask = pattern_mask & batch.shift(token_vector(batch), offset)
+            mask = pattern_mask if mask is None else mask | pattern_mask
+        return mask
+
+    return match, vector
+
+
+def _expressions_rule(name, spec, docs_dir):
+    expressions = spec['expressions']
+    if isinstance(expressions, str):
+        expressions = lexicons.read_lexicon(expressions, docs_dir)
+    automaton = AhoCorasick(expression.lower() for expression in expressions)
+    unless = tuple(spec.get('unless', ()))
+    weight = float(spec['weight'])
+    explanation = spec.get('explanation')
+
+    def evaluate(sentence, tweet, explain):
+        for text in unless:
+            if text in sentence:
+                return 0.0, None
+        found = automaton.findall(str(sentence).lower())
+        if found:
+            if explain:
+                logging.info(found)
+            return weight, explanation if explain else None
+        return 0.0, None
+
+    return engine.TweetRule(name, evaluate)
+
+
+def _builtin_rule(name, spec, builtins):
+    rule = builtins.get(spec['builtin'])
+    if rule is None:
+        raise ValueError("unknown builtin rule {}".format(spec['builtin']))
+    if isinstance(rule, engine.TweetRule):
+        if 'weight' in spec or 'explanation' in spec:
+            raise ValueError("the builtin rule {} can't be re-weighted".format(spec['builtin']))
+        return engine.TweetRule(name, rule.evaluate, rule.vector)
+    return engine.TokenRule(name, rule.match, float(spec.get('weight', rule.score)),
+                            spec.get('explanation', rule.explanation), vector=rule.vector,
+                            patterns=rule.patterns, tags=[token_array.POS[tag] for tag in rule.tags]
+                            if rule.tags is not None else None)
+
+
+def compile_spec(spec, builtins=None, docs_dir=lexicons.DOCS_DIR):
+    """
+    Compiles a rule spec (already parsed from YAML or JSON) into a RuleSet.
+
+    :param spec: the spec, a dict with the list of the rules
+    :type spec: dict
+    :param builtins: the rules that can be referenced with 'builtin', by name
+    :type builtins: dict, optional
+    :param docs_dir: the directory of the expression files
+    :type docs_dir: str
+    :rtype: RuleSet
+    """
+    if spec.get('version', SPEC_VERSION) != SPEC_VERSION:
+        raise ValueError("unsupported rule spec version {}".format(spec.get('version')))
+    rules = []
+    names = set()
+    for rule_spec in spec['rules']:
+        name = rule_spec['name']
+        if name in names:
+            raise ValueError("duplicate rule {}".format(name))
+        names.add(name)
+        try:
+            if 'builtin' in rule_spec:
+                rules.append(_builtin_rule(name, rule_spec, builtins or {}))
+            elif 'expressions' in rule_spec:
+                rules.append(_expressions_rule(name, rule_spec, docs_dir))
+            elif 'patterns' in rule_spec:
+                patterns = rule_spec['patterns']
+                match, vector = compile_patterns(patterns)
+                rules.append(engine.TokenRule(name, match, float(rule_spec['weight']), rule_spec.get('explanation'),
+                                              tags=_anchor_tags(patterns), vector=vector, patterns=patterns))
+            else:
+                raise ValueError("a rule needs patterns, expressions or builtin")
+        except (KeyError, TypeError, ValueError, re.error) as e:
+            raise ValueError("rule {}: {}".format(name, e)) from e
+    return RuleSet(rules)
+
+
+def load_spec(path, builtins=None, docs_dir=lexicons.DOCS_DIR):
+    # JSON is a subset of YAML, so both are read by the YAML parser
+    import yaml
+    with open(path, 'r', encoding='utf-8') as f:
+        spec = yaml.safe_load(f)
+    return compile_spec(spec, builtins, docs_dir)
+
+
+class RuleFile:
+
+    def __init__(self, path, builtins=None, docs_dir=lexicons.DOCS_DIR, check_every=CHECK_EVERY):
+        """
+        Compiles the spec in path; current() compiles it again when the file changes.
+
+        :param path: the path of the spec
+        :type path: str
+        :param builtins: the rules that can be referenced with 'builtin', by name
+        :type builtins: dict, optional
+        :param check_every: the seconds between two checks of the modification time of the file
+        :type check_every: float
+        """
+        self.path = path
+        self.builtins = builtins
+        self.docs_dir = docs_dir
+        self.check_every = check_every
+        self._lock = threading.Lock()
+        self._mtime = os.stat(path).st_mtime_ns
+        self._checked = time.monotonic()
+        self._rule_set = load_spec(path, builtins, docs_dir)
+
+    def current(self):
+        """
+        Returns the RuleSet of the spec, compiled again if the file changed. If the new spec is not valid
+        the error is logged and the previous rules are kept.
+        """
+        import yaml
+        now = time.monotonic()
+        if now - self._checked >= self.check_every and self._lock.acquire(blocking=False):
+            try:
+                self._checked = now
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime != self._mtime:
+                    self._mtime = mtime
+                    self._rule_set = load_spec(self.path, self.builtins, self.docs_dir)
+                    message = "Reloaded the rules of {}".format(self.path)
+                    logging.info(message)
+                    print(message)
+            except (OSError, ValueError, yaml.YAMLError) as e:
+                message = "Rules of {} not reloaded: {}".format(self.path, e)
+                logging.error(message)
+                print(message)
+            finally:
+                self._lock.release()
+        return self._rule_set
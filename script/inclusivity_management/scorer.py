@@ -0,0 +1,67 @@
+import lexicons
+import Rules
+
+"""
+scorer.py:
+This module contains InclusivityScorer, the API to score tweets from other programs (services, notebooks)
+without the CLI of Rules.py: the spaCy model and the lexicons are loaded once, when the scorer is created,
+and every call reuses them, so a scorer kept alive can score millions of tweets paying the startup only once.
+The results are the ones of the CLI: a dict with the cleaned tweet ('Tweet'), its score ('inclusive_rate')
+and the explanations of the rules that fired ('explanation').
+    scorer = InclusivityScorer()
+    scorer.score("Gli impiegati sono pregati di spegnere la luce")
+    scorer.score_batch(tweets)
+    for result in scorer.score_iter(read_tweets()): ...
+"""
+
+
+class InclusivityScorer:
+
+    def __init__(self, model_name=Rules.MODEL_NAME, nlp=None, explain=True, batch_size=Rules.BATCH_SIZE, n_process=1,
+                 cache=None, vectorized=False, matcher=False):
+        """
+        Loads the model and the lexicons.
+
+        :param model_name: the spaCy model, loaded if nlp is not given: a tier (sm, md, lg), a package or a path
+        :type model_name: str
+        :param nlp: a spaCy model already loaded, shared with the caller
+        :type nlp: spacy.language.Language, optional
+        :param explain: whether the results have the explanations of the rules
+        :type explain: bool
+        :param batch_size: the number of tweets parsed together by spaCy
+        :type batch_size: int
+        :param n_process: the number of processes used by spaCy to parse the tweets
+        :type n_process: int
+        :param cache: the cache of the parses
+        :type cache: parse_cache.ParseCache, optional
+        :param vectorized: whether the rules are evaluated in batch mode (see vector_engine.py)
+        :type vectorized: bool
+        :param matcher: whether the pattern rules are matched by the spaCy Matcher (see matcher_engine.py)
+        :type matcher: bool
+        """
+        self.nlp = nlp if nlp is not None else Rules.load_model(model_name)
+        lexicons.get()
+        self.explain = explain
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.cache = cache
+        self.vectorized = vectorized
+        self.matcher = matcher
+
+    def score_iter(self, tweets):
+        """
+        Scores the tweets lazily, yielding their results in input order: only batch_size tweets at a time are
+        held by the parser, so it can stream an input of any size.
+        """
+        parsed = Rules.iter_postag(tweets, self.batch_size, self.n_process, cache=self.cache, matcher=self.matcher,
+                                   model=self.nlp)
+        return Rules.iter_rules(parsed, self.explain, self.vectorized)
+
+    def score_batch(self, tweets):
+        """
+        Returns the list of the results of the tweets, in input order.
+        """
+        return list(self.score_iter(tweets))
+
+    def score(self, tweet):
+        return self.score_batch([tweet])[0]
@@ -0,0 +1,287 @@
+import argparse
+import bisect
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import Rules
+import scorer
+
+"""
+service.py:
+This module contains a local HTTP/JSON service that keeps the model warm and scores the tweets sent to it:
+- POST /score        {"text": "..."}            -> the result of the tweet
+- POST /score_batch  {"texts": ["...", ...]}    -> {"results": [...]}, in the order of the texts
+- GET  /latency                                 -> the histogram of the latencies of the requests
+- GET  /health                                  -> {"status": "ok"}
+The results are the ones of Rules.py ('Tweet', 'inclusive_rate', 'explanation').
+The requests are served by a thread each, but the model is used by a single thread, the MicroBatcher: the
+texts of the concurrent requests are coalesced into micro-batches of at most --max_batch texts, waiting at
+most --max_wait seconds after the first one, and each micro-batch goes through nlp.pipe at once.
+Run it from script/inclusivity_management, as Rules.py:
+    python service.py --port 8000
+"""
+
+HOST = '127.0.0.1'
+PORT = 8000
+MAX_BATCH = 64
+MAX_WAIT = 0.005
+# upper bounds of the buckets of the latency histogram, in ms
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+MAX_BODY = 10 * 1024 * 1024
+# connections waiting to be accepted, the concurrent clients are many more than the default 5
+REQUEST_QUEUE_SIZE = 128
+
+
+class LatencyHistogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: the upper bounds of the buckets in ms, in increasing order; the last bucket has no bound
+        :type buckets: list of float
+        """
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+            self.count += 1
+            self.total += ms
+
+    def percentile(self, q):
+        # the upper bound of the bucket of the q-th latency, None if it's in the last bucket
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank and seen > 0:
+                return bound
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'mean_ms': self.total / self.count if self.count else 0.0,
+                'p50_ms': self.percentile(0.50),
+                'p99_ms': self.percentile(0.99),
+                'buckets': [{'le_ms': bound, 'count': count} for bound, count in
+                            zip(self.buckets + ['inf'], self.counts)],
+            }
+
+
+class MicroBatcher:
+
+    def __init__(self, score_batch, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        """
+        Scores the texts submitted by many threads in micro-batches, from a single thread.
+
+        :param score_batch: the function that scores a list of texts, returning the list of their results
+        :type score_batch: callable
+        :param max_batch: the number of texts after which a micro-batch is scored without waiting
+        :type max_batch: int
+        :param max_wait: the seconds a micro-batch waits for more texts after the first one
+        :type max_wait: float
+        """
+        self.score_batch = score_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        # the request that didn't fit in the last micro-batch, the first one of the next
+        self._carried = None
+        self._thread = threading.Thread(target=self._run, name='MicroBatcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, texts):
+        """
+        Returns a Future of the list of the results of texts. A list longer than max_batch is scored on its own.
+        """
+        future = Future()
+        self._queue.put((list(texts), future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        # the requests of the next micro-batch, None when closed
+        first = self._carried
+        self._carried = None
+        if first is None:
+            first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # scored before closing
+                self._queue.put(None)
+                break
+            if size + len(request[0]) > self.max_batch:
+                self._carried = request
+                break
+            batch.append(request)
+            size += len(request[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            texts = [text for request_texts, future in batch for text in request_texts]
+            try:
+                results = self.score_batch(texts)
+            except Exception as e:
+                if len(batch) == 1:
+                    logging.exception("Request of %d texts not scored", len(texts))
+                    batch[0][1].set_exception(e)
+                    continue
+                # the requests are scored again one at a time, so only the ones that fail get the error
+                logging.exception("Micro-batch of %d texts not scored, scoring its requests one at a time",
+                                  len(texts))
+                for request_texts, future in batch:
+                    try:
+                        future.set_result(self.score_batch(request_texts))
+                    except Exception as e:
+                        logging.exception("Request of %d texts not scored", len(request_texts))
+                        future.set_exception(e)
+                continue
+            start = 0
+            for request_texts, future in batch:
+                future.set_result(results[start:start + len(request_texts)])
+                start += len(request_texts)
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, {'status': 'ok'})
+        elif self.path == '/latency':
+            self._send(200, self.server.latency.snapshot())
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        try:
+            request = self._read_json()
+            if self.path == '/score':
+                text = request.get('text')
+                if not isinstance(text, str):
+                    raise ValueError("'text' should be a string")
+                self._send(200, self.server.batcher.submit([text]).result()[0])
+            elif self.path == '/score_batch':
+                texts = request.get('texts')
+                if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+                    raise ValueError("'texts' should be a list of strings")
+                self._send(200, {'results': self.server.batcher.submit(texts).result() if texts else []})
+            else:
+                self._send(404, {'error': 'not found'})
+        except ValueError as e:
+            self._send(400, {'error': str(e)})
+        except Exception as e:
+            self._send(500, {'error': str(e)})
+        finally:
+            self.server.latency.observe(time.perf_counter() - start)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        if length > MAX_BODY:
+            raise ValueError("request body larger than {} bytes".format(MAX_BODY))
+        try:
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+        except UnicodeDecodeError as e:
+            raise ValueError("request body not in UTF-8: {}".format(e))
+        if not isinstance(request, dict):
+            raise ValueError("request body should be a JSON object")
+        return request
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.info("%s - %s", self.address_string(), format % args)
+
+
+class ScoringServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+
+def make_server(inclusivity_scorer, host=HOST, port=PORT, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+    """
+    Returns the ScoringServer of the service, with its MicroBatcher (batcher) and LatencyHistogram (latency).
+    """
+    server = ScoringServer((host, port), ScoringHandler)
+    server.batcher = MicroBatcher(inclusivity_scorer.score_batch, max_batch, max_wait)
+    server.latency = LatencyHistogram()
+    return server
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Inclusivity rate service')
+    parser.add_argument('--host', type=str, default=HOST,
+                        help="This parameter should be the address the service listens on")
+    parser.add_argument('--port', type=int, default=PORT,
+                        help="This parameter should be the port the service listens on")
+    parser.add_argument('--max_batch', type=int, default=MAX_BATCH,
+                        help="This parameter should be the largest number of texts scored together")
+    parser.add_argument('--max_wait', type=float, default=MAX_WAIT,
+                        help="This parameter should be the seconds a batch waits for more texts")
+    parser.add_argument('--batch_size', type=int, default=Rules.BATCH_SIZE,
+                        help="This parameter should be the number of tweets parsed together by spaCy")
+    parser.add_argument('--no_explain', dest='explain', action='store_false',
+                        help="This parameter don't return the explaination of the score")
+    parser.set_defaults(explain=True)
+    parser.add_argument('--rules', type=str,
+                        help="This parameter should be a path to a YAML or JSON spec of the rules "
+                             "(e.g. docs/rules.yaml), reloaded when it changes")
+    parser.add_argument('--model', type=str, default=Rules.MODEL_NAME,
+                        help="This parameter should be the spaCy model: a tier (sm, md, lg), the name of a package "
+                             "or the path of a model; sm has no word vectors and uses the least memory")
+    parser.add_argument('--verbose', dest='verbose', action='store_true')
+    parser.set_defaults(verbose=False)
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(filename="../../log.txt", level=logging.INFO)
+    if args.rules is not None:
+        Rules.load_rules(args.rules)
+
+    server = make_server(scorer.InclusivityScorer(args.model, explain=args.explain, batch_size=args.batch_size),
+                         args.host, args.port, args.max_batch, args.max_wait)
+    print("Serving on http://{}:{}".format(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
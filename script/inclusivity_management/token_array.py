@@ -0,0 +1,178 @@
+import threading
+from array import array
+
+import lexicons
+
+"""
+token_array.py:
+This module contains the compact representation of a parsed tweet used by the rules of Rules.py.
+Instead of a tuple and a dict of morphological features per token, a TokenArray keeps parallel arrays:
+- text, lemma:  the strings of the tokens.
+- pos, dep:     the ids of the POS tags and of the dependency labels.
+- morph:        the ids of the morphological analyses ("Gender=Fem|Number=Sing").
+- classes:      the bitmask of the lexicon classes of the tokens (see lexicons.classify()).
+- matches:      the names of the rules matched on the doc by matcher_engine.MatcherEngine, None if not matched.
+Tags, labels and analyses are interned once per process, so every token with the same analysis shares
+the same read-only dict of features, returned by TokenArray.feats().
+The ids of the POS tags are the same in every process; a TokenArray is pickled with its strings (shared
+by the pickle memo), so it can be sent to another process whatever the ids of its labels there.
+"""
+
+# Universal POS tags, in a fixed order
+POS_TAGS = ['', 'ADJ', 'ADP', 'ADV', 'AUX', 'CCONJ', 'DET', 'INTJ', 'NOUN', 'NUM', 'PART', 'PRON', 'PROPN',
+            'PUNCT', 'SCONJ', 'SYM', 'VERB', 'X', 'SPACE']
+# Universal dependency relations, the labels of the model not in the list are added when seen
+DEP_LABELS = ['', 'ROOT', 'acl', 'advcl', 'advmod', 'amod', 'appos', 'aux', 'case', 'cc', 'ccomp', 'clf',
+              'compound', 'conj', 'cop', 'csubj', 'dep', 'det', 'discourse', 'dislocated', 'expl', 'fixed',
+              'flat', 'goeswith', 'iobj', 'list', 'mark', 'nmod', 'nsubj', 'nummod', 'obj', 'obl', 'orphan',
+              'parataxis', 'punct', 'reparandum', 'vocative', 'xcomp']
+
+
+class Interner:
+
+    def __init__(self, strings=()):
+        """
+        Maps strings to consecutive ids, the same string always gets the same id.
+
+        :param strings: the strings with the first ids, in order
+        :type strings: iterable of str
+        """
+        self.strings = []
+        self.ids = {}
+        self._lock = threading.Lock()
+        for string in strings:
+            self.id(string)
+
+    def id(self, string):
+        value = self.ids.get(string)
+        if value is None:
+            with self._lock:
+                value = self.ids.get(string)
+                if value is None:
+                    value = len(self.strings)
+                    self.strings.append(string)
+                    self.ids[string] = value
+        return value
+
+    def __getitem__(self, value):
+        return self.strings[value]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+POS = Interner(POS_TAGS)
+DEP = Interner(DEP_LABELS)
+MORPH = Interner([''])
+# features of each analysis in MORPH, by id: shared by all the tokens, never modified
+FEATURES = [{}]
+
+
+def morph_id(morph):
+    value = MORPH.id(morph)
+    if value >= len(FEATURES):
+        with MORPH._lock:
+            while len(FEATURES) < len(MORPH):
+                features = {}
+                for feature in MORPH[len(FEATURES)].split('|'):
+                    if len(feature) != 0:
+                        couple = feature.split('=')
+                        features[couple[0]] = couple[1]
+                FEATURES.append(features)
+    return value
+
+
+def pos_id(tag):
+    return POS.id(tag)
+
+
+def dep_id(label):
+    return DEP.id(label)
+
+
+class TokenArray:
+
+    __slots__ = ('text', 'pos', 'dep', 'morph', 'classes', 'lemma', 'matches')
+
+    def __init__(self, text, pos, dep, morph, classes, lemma, matches=None):
+        """
+        Use from_tokens() or from_doc() to build it from a parse.
+
+        :param text: the texts of the tokens
+        :type text: tuple of str
+        :param pos: the ids of the POS tags (see pos_id())
+        :type pos: array
+        :param dep: the ids of the dependency labels (see dep_id())
+        :type dep: array
+        :param morph: the ids of the morphological analyses (see morph_id())
+        :type morph: array
+        :param classes: the lexicon classes of the tokens
+        :type classes: array
+        :param lemma: the lemmas of the tokens
+        :type lemma: tuple of str
+        :param matches: the names of the rules matched on the doc by the spaCy Matcher, if it was run
+        :type matches: frozenset, optional
+        """
+        self.text = text
+        self.pos = pos
+        self.dep = dep
+        self.morph = morph
+        self.classes = classes
+        self.lemma = lemma
+        self.matches = matches
+
+    @classmethod
+    def from_tokens(cls, tokens, matches=None):
+        """
+        Builds the array from tokens as returned by parse_cache.doc_tokens(): [text, pos, dep, morph features, lemma].
+        """
+        text = []
+        pos = array('B')
+        dep = array('H')
+        morph = array('I')
+        lemma = []
+        for token_text, token_pos, token_dep, token_morph, token_lemma in tokens:
+            text.append(token_text)
+            pos.append(POS.id(token_pos))
+            dep.append(DEP.id(token_dep))
+            morph.append(morph_id(token_morph))
+            lemma.append(token_lemma)
+        classes = array('I', [lexicons.classify(token_text) for token_text in text])
+        return cls(tuple(text), pos, dep, morph, classes, tuple(lemma), matches)
+
+    @classmethod
+    def from_doc(cls, doc, matches=None):
+        return cls.from_tokens(((token.text, token.pos_, token.dep_, '|'.join(token.morph), token.lemma_)
+                                for token in doc), matches)
+
+    def feats(self, idx):
+        """
+        Returns the dict of the morphological features of token idx, shared with the other tokens: don't modify it.
+        """
+        return FEATURES[self.morph[idx]]
+
+    def __len__(self):
+        return len(self.text)
+
+    def __getitem__(self, idx):
+        """
+        Returns the record (text, pos, dep, morph, classes, lemma) of token idx, with the tags as strings.
+        """
+        return (self.text[idx], POS[self.pos[idx]], DEP[self.dep[idx]], FEATURES[self.morph[idx]],
+                self.classes[idx], self.lemma[idx])
+
+    def __iter__(self):
+        for idx in range(len(self.text)):
+            yield self[idx]
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __reduce__(self):
+        return _restore, (self.text, tuple(POS[i] for i in self.pos), tuple(DEP[i] for i in self.dep),
+                          tuple(MORPH[i] for i in self.morph), self.classes, self.lemma, self.matches)
+
+
+def _restore(text, pos, dep, morph, classes, lemma, matches=None):
+    return TokenArray(text, array('B', [POS.id(tag) for tag in pos]), array('H', [DEP.id(label) for label in dep]),
+                      array('I', [morph_id(analysis) for analysis in morph]), classes, lemma, matches)
@@ -1,82 +1,149 @@
 import re
-import yaml
-import pandas as pd
+import sys
+from collections import Counter
+from fractions import Fraction
+import lexicons
 
 def read_tsv(tsv):
+    import pandas as pd
     rd = pd.read_csv(tsv, sep='\t')
     return rd
 
 
 def check_female_name(token):
-    with open('docs/nomif.txt', 'r', encoding='utf-8') as f:
-        myNamesFemale = set(line.strip() for line in f)
-
-    if token.lower() in myNamesFemale:
+    if token.lower() in lexicons.get().female_names:
         return True
     else:
         return False
 
 
 def check_male_name(token):
-    with open('docs/nomim.txt', 'r', encoding='utf-8') as f:
-        myNamesMale = set(line.strip() for line in f)
-
-    if token.lower() in myNamesMale:
+    if token.lower() in lexicons.get().male_names:
         return True
     else:
         return False
 
 
 def check_surname(token):
-    with open('docs/lista_cognomi.txt', 'r', encoding='utf-8') as f:
-        mySurnames = set(line.strip() for line in f)
-
-    if token.lower() in mySurnames:
+    if token.lower() in lexicons.get().surnames:
         return True
     else:
         return False
 
-def clean_tweet (t):
-    clean_tweet = re.sub("@[A-Za-z0-9_]+", "", t)
-    clean_tweet = re.sub("#[A-Za-z0-9_]+", "", clean_tweet)
-    clean_link = re.sub(r"http\S+", "", clean_tweet)
-    regrex_pattern = re.compile(pattern="["
-                                        u"\U0001F600-\U0001F64F"  # emoticons
-                                        u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-                                        u"\U0001F680-\U0001F6FF"  # transport & map symbols
-                                        u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-                                        u"\U00002500-\U00002BEF"  # chinese char
-                                        u"\U00002702-\U000027B0"
-                                        u"\U00002702-\U000027B0"
-                                        u"\U000024C2-\U0001F251"
-                                        u"\U0001f926-\U0001f937"
-                                        u"\U00010000-\U0010ffff"
-                                        u"\u2640-\u2642" 
-                                        u"\u2600-\u2B55"
-                                        u"\u200d"
-                                        u"\u23cf"
-                                        u"\u23e9"
-                                        u"\u231a"
-                                        u"\ufe0f"  # dingbats
-                                        u"\u3030"
-                                        "]+", flags=re.UNICODE)
-    result = regrex_pattern.sub(r'', clean_link)
-    result = result.lower()
-    return result
+EMOJI = ("["
+         u"\U0001F600-\U0001F64F"  # emoticons
+         u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+         u"\U0001F680-\U0001F6FF"  # transport & map symbols
+         u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+         u"\U00002500-\U00002BEF"  # chinese char
+         u"\U00002702-\U000027B0"
+         u"\U00002702-\U000027B0"
+         u"\U000024C2-\U0001F251"
+         u"\U0001f926-\U0001f937"
+         u"\U00010000-\U0010ffff"
+         u"\u2640-\u2642"
+         u"\u2600-\u2B55"
+         u"\u200d"
+         u"\u23cf"
+         u"\u23e9"
+         u"\u231a"
+         u"\ufe0f"  # dingbats
+         u"\u3030"
+         "]+")
+
+# mentions and hashtags, links and emoji removed in a single pass, with the result of removing them one after
+# the other: a link is "http" and at least one more character once the mentions and hashtags are removed, so
+# the ones right after "http" are skipped before \S+ (all of them, as an atomic group, or "http@user " would
+# be removed by backtracking into the mention)
+CLEANER = re.compile("[@#][A-Za-z0-9_]+"
+                     r"|http(?=((?:[@#][A-Za-z0-9_]+)*))\1\S+"
+                     "|" + EMOJI, flags=re.UNICODE)
+
+
+def clean_tweet(t):
+    return CLEANER.sub('', t).lower()
+
+
+def clean_batch(tweets):
+    """
+    Cleans the tweets as clean_tweet(): a pandas Series gives a Series with the same index, any other iterable a list.
+    """
+    sub = CLEANER.sub
+    cleaned = [sub('', t).lower() for t in tweets]
+    # pandas is imported by who passes a Series
+    pd = sys.modules.get('pandas')
+    if pd is not None and isinstance(tweets, pd.Series):
+        return pd.Series(cleaned, index=tweets.index, name=tweets.name)
+    return cleaned
 
 
 def calculate_user_score(results_csv):
+    import pandas as pd
 
     tweets = pd.read_csv(results_csv)
     df = pd.DataFrame(tweets)
     inclusivity_sum = df['inclusive_rate'].sum()
     n_tweets = df['inclusive_rate'].count()
     inclusivity_score = inclusivity_sum/n_tweets
+    return inclusivity_score, user_label(inclusivity_score)
+
+
+def user_label(inclusivity_score):
     if inclusivity_score > 0.00:
-        user_label = "inclusive"
+        return "inclusive"
     elif inclusivity_score == 0.00:
-        user_label = "neutral"
+        return "neutral"
     else:
-        user_label = "non-inclusive"
+        return "non-inclusive"
+
+
+class UserScores:
+
+    def __init__(self):
+        """
+        Aggregates the scores of the tweets of each user while they are scored, keeping for each user only the
+        count and the histogram of the scores, without writing and reading them back.
+        The score of a user is the mean of the scores computed exactly from the histogram, and rounded once:
+        it doesn't depend on the order of the tweets, and scores that cancel out give 0.0 and the "neutral"
+        label. calculate_user_score() sums the csv in floating point, so it can differ in the last digits and,
+        when the scores cancel out, in the label.
+        """
+        # user -> [count, Counter of the scores]
+        self.users = {}
+
+    def add(self, user, score):
+        entry = self.users.get(user)
+        if entry is None:
+            entry = self.users[user] = [0, Counter()]
+        entry[0] += 1
+        entry[1][score] += 1
+
+    def feed(self, user, results):
+        """
+        Yields the results of the tweets of user (as the ones of Rules.iter_rules()), adding their scores.
+        """
+        for result in results:
+            self.add(user, result['inclusive_rate'])
+            yield result
+
+    def count(self, user):
+        return self.users[user][0] if user in self.users else 0
+
+    def mean(self, user):
+        # 0.0 for a user without tweets
+        count, histogram = self.users.get(user, (0, None))
+        if not count:
+            return 0.0
+        return float(sum(Fraction(score) * n for score, n in histogram.items()) / count)
+
+    def label(self, user):
+        return user_label(self.mean(user))
+
+    def histogram(self, user):
+        # score -> number of tweets, by increasing score
+        return dict(sorted(self.users[user][1].items())) if user in self.users else {}
 
-    return inclusivity_score, user_label
+    def user_score(self, user):
+        # the (inclusivity_score, user_label) of the user, as the ones of calculate_user_score()
+        score = self.mean(user)
+        return score, user_label(score)
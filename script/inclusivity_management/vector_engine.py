@@ -0,0 +1,180 @@
+from array import array
+
+import numpy as np
+
+import lexicons
+
+import engine
+import token_array
+
+"""
+vector_engine.py:
+This module contains the batch mode of the rule engine: the token arrays of many tweets are concatenated
+in a TokenBatch, and each pattern rule is evaluated on all of them at once, as comparisons between the
+arrays of the batch and the same arrays shifted by the offset of the pattern.
+The token matches are then reduced to one flag per tweet, using the offsets of the tweets in the batch.
+A TokenRule is evaluated in batch mode if it has a vector function (see engine.TokenRule), that returns
+the mask of the tokens where its pattern matches; the other rules (and the TweetRule ones, as
+male_collettives() and male_expressions()) are evaluated tweet by tweet. The vector function of a
+TweetRule returns the tokens the rule needs to fire: the tweets without any of them are not evaluated.
+"""
+
+
+class TokenBatch:
+
+    def __init__(self, tweets):
+        """
+        Concatenates the tweets of the batch.
+
+        :param tweets: the tweets of the batch
+        :type tweets: list of token_array.TokenArray
+        """
+        self.tweets = tweets
+        lengths = np.fromiter((len(tweet) for tweet in tweets), dtype=np.int64, count=len(tweets))
+        self.offsets = np.zeros(len(tweets) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.size = int(self.offsets[-1])
+        # index of the tweet of each token, position of the token in its tweet and length of its tweet
+        self.segment = np.repeat(np.arange(len(tweets)), lengths)
+        self.position = np.arange(self.size) - self.offsets[self.segment]
+        self.length = lengths[self.segment]
+        self.pos = self._concatenate('pos')
+        self.dep = self._concatenate('dep')
+        self.morph = self._concatenate('morph')
+        self.classes = self._concatenate('classes')
+        self.text = [text for tweet in tweets for text in tweet.text]
+        self._features = {}
+
+    def _concatenate(self, field):
+        if not self.tweets:
+            return np.zeros(0, dtype=np.int64)
+        # the typecodes of the arrays are numpy dtypes too
+        values = array(getattr(self.tweets[0], field).typecode)
+        for tweet in self.tweets:
+            values.extend(getattr(tweet, field))
+        return np.frombuffer(values, dtype=values.typecode)
+
+    def __len__(self):
+        return len(self.tweets)
+
+    def feature(self, name, value=None):
+        """
+        Returns the mask of the tokens that have the morphological feature name (with the given value, if any).
+        """
+        key = (name, value)
+        mask = self._features.get(key)
+        if mask is None:
+            table = np.fromiter((name in features and (value is None or features[name] == value)
+                                 for features in token_array.FEATURES), dtype=bool, count=len(token_array.FEATURES))
+            mask = table[self.morph]
+            self._features[key] = mask
+        return mask
+
+    def text_in(self, values):
+        values = frozenset(values)
+        return np.fromiter((text in values for text in self.text), dtype=bool, count=self.size)
+
+    def text_endswith(self, suffixes):
+        suffixes = tuple(suffixes)
+        return np.fromiter((text.endswith(suffixes) for text in self.text), dtype=bool, count=self.size)
+
+    def text_where(self, predicate):
+        return np.fromiter((predicate(text) for text in self.text), dtype=bool, count=self.size)
+
+    def lemma_where(self, predicate):
+        return np.fromiter((predicate(lemma) for tweet in self.tweets for lemma in tweet.lemma), dtype=bool,
+                           count=self.size)
+
+    def label_where(self, field, predicate):
+        """
+        Returns the mask of the tokens whose id in field ('pos', 'dep' or 'morph') satisfies predicate(id),
+        evaluating it once per id.
+        """
+        values = getattr(self, field)
+        if not self.size:
+            return np.zeros(0, dtype=bool)
+        table = np.fromiter((predicate(value) for value in range(int(values.max()) + 1)), dtype=bool)
+        return table[values]
+
+    def has_class(self, classes):
+        return (self.classes & classes) != 0
+
+    def lemma_has_class(self, classes, where):
+        """
+        Returns the mask of the tokens in where whose lemma is in the lexicon classes, classifying only those lemmas.
+        """
+        mask = np.zeros(self.size, dtype=bool)
+        for idx in np.flatnonzero(where):
+            lemma = self.tweets[self.segment[idx]].lemma[self.position[idx]]
+            mask[idx] = lexicons.classify(lemma) & classes != 0
+        return mask
+
+    def valid(self, offset):
+        """
+        Returns the mask of the tokens whose token at the given offset is in the same tweet.
+        """
+        return (self.position + offset >= 0) & (self.position + offset < self.length)
+
+    def shift(self, values, offset):
+        """
+        Returns the array of the values of the tokens at the given offset; where valid(offset) is False
+        the value is of another tweet (or a padding), so it has to be masked.
+        """
+        if offset == 0 or len(values) == 0:
+            return values
+        shifted = np.zeros_like(values)
+        if offset > 0:
+            shifted[:-offset] = values[offset:]
+        else:
+            shifted[-offset:] = values[:offset]
+        return shifted
+
+    def reduce(self, mask):
+        """
+        Returns the mask of the tweets with at least one token in mask.
+        """
+        fired = np.zeros(len(self.tweets), dtype=bool)
+        fired[self.segment[mask]] = True
+        return fired
+
+
+class VectorEngine:
+
+    def __init__(self, rules):
+        """
+        :param rules: the rules, in the order of their scores and explanations
+        :type rules: iterable of engine.TokenRule and engine.TweetRule
+        """
+        self.rules = tuple(rules)
+        self.names = tuple(rule.name for rule in self.rules)
+
+    def evaluate_batch(self, sentences, tweets, explain):
+        """
+        Evaluates all the rules on a batch of tweets.
+
+        :return: for each tweet, the list of (score, explanation) of every rule, in the order of the rules
+        :rtype: list
+        """
+        batch = TokenBatch(tweets)
+        # rule position -> mask of the tweets where the rule fires (TokenRule) or can fire (TweetRule)
+        fired = {}
+        for pos, rule in enumerate(self.rules):
+            if rule.vector is not None and batch.size:
+                fired[pos] = batch.reduce(rule.vector(batch))
+
+        results = []
+        for i, (sentence, tweet) in enumerate(zip(sentences, tweets)):
+            tweet_results = []
+            for pos, rule in enumerate(self.rules):
+                if isinstance(rule, engine.TweetRule):
+                    if pos in fired and not fired[pos][i]:
+                        tweet_results.append((0.0, None))
+                    else:
+                        tweet_results.append(rule.evaluate(sentence, tweet, explain))
+                elif pos in fired:
+                    tweet_results.append((rule.score, rule.explanation if explain else None) if fired[pos][i]
+                                         else (0.0, None))
+                else:
+                    tweet_results.append(rule.evaluate(sentence, tweet, explain))
+            results.append(tweet_results)
+        return results